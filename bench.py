@@ -0,0 +1,483 @@
+"""Benchmark offline do caminho quente de moderação.
+
+Roda os handlers do main.py (on_message, on_member_join, on_member_update e o
+.mute) contra objetos falsos do discord que só registram as chamadas REST, sem
+rede e sem token. Cada cenário roda num processo próprio com banco de estado
+temporário, para não herdar mutes, janelas ou caches do cenário anterior; a
+contagem de alocações roda num segundo processo com tracemalloc ligado para não
+contaminar as latências.
+
+    python bench.py                      # todos os cenários
+    python bench.py repeticao raid       # só alguns
+    python bench.py --json               # uma linha JSON por cenário (CI)
+    python bench.py --rotas              # quebra de chamadas REST por rota
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+from discord.utils import SnowflakeList
+
+SEED = 1234
+CANAIS = 20
+MEMBROS = 300
+
+# ---------------------------------------------------------------------------
+# objetos falsos do discord: guardam estado mínimo e contam as chamadas REST
+# ---------------------------------------------------------------------------
+
+class RegistroREST:
+    def __init__(self):
+        self.chamadas = Counter()
+
+    async def __call__(self, rota: str, valor=None):
+        self.chamadas[rota] += 1
+        await asyncio.sleep(0)  # cede o loop como uma chamada de verdade cederia
+        return valor
+
+rest = RegistroREST()
+
+class FakeObjeto:
+    def __init__(self, id: int):
+        self.id = id
+
+    def __eq__(self, outro):
+        return getattr(outro, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeRole(FakeObjeto):
+    def __init__(self, id: int, name: str):
+        super().__init__(id)
+        self.name = name
+        self.mention = f"<@&{id}>"
+
+class FakeSticker(FakeObjeto):
+    pass
+
+class FakeParcial(FakeObjeto):
+    async def delete(self):
+        await rest("apagar_mensagem")
+
+class FakeCanal(FakeObjeto):
+    def __init__(self, id: int, name: str, guild):
+        super().__init__(id)
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{id}>"
+        self.category = None
+        self.permissions_synced = False
+        self._overwrites = {}  # target_id -> PermissionOverwrite
+
+    def overwrites_for(self, alvo):
+        atual = self._overwrites.get(alvo.id)
+        return discord.PermissionOverwrite(**dict(atual)) if atual is not None else discord.PermissionOverwrite()
+
+    async def set_permissions(self, alvo, *, overwrite=None, reason=None, **permissoes):
+        if permissoes:
+            overwrite = discord.PermissionOverwrite(**permissoes)
+        if overwrite is None or overwrite.is_empty():
+            self._overwrites.pop(alvo.id, None)
+        else:
+            self._overwrites[alvo.id] = overwrite
+        await rest("set_permissions")
+
+    async def send(self, content=None, *, embed=None, embeds=None, delete_after=None):
+        await rest("send")
+
+    async def delete_messages(self, mensagens):
+        await rest("delete_messages")
+
+    def get_partial_message(self, message_id: int):
+        return FakeParcial(message_id)
+
+    async def delete(self, reason=None):
+        await rest("apagar_canal")
+
+class FakeMembro(FakeObjeto):
+    def __init__(self, id: int, guild, *, roles=(), criado_ha: timedelta = timedelta(days=400), bot=False):
+        super().__init__(id)
+        self.guild = guild
+        self.name = f"membro{id}"
+        self.display_name = self.name
+        self.nick = None
+        self.bot = bot
+        self.mention = f"<@{id}>"
+        self.roles = list(roles)
+        self._roles = SnowflakeList([r.id for r in roles])
+        self.created_at = datetime.now(timezone.utc) - criado_ha
+        self.joined_at = datetime.now(timezone.utc)
+        self.voice = None
+        self._timeout = None
+
+    def is_timed_out(self) -> bool:
+        return self._timeout is not None
+
+    async def timeout(self, duracao, reason=None):
+        self._timeout = duracao
+        await rest("timeout")
+
+    async def edit(self, reason=None, **campos):
+        if "nick" in campos:
+            self.nick = campos["nick"]
+        await rest("editar_membro")
+
+    async def add_roles(self, *roles, reason=None):
+        await rest("add_roles")
+
+    async def remove_roles(self, *roles, reason=None):
+        await rest("remove_roles")
+
+    async def kick(self, reason=None):
+        await rest("kick")
+
+class FakeMensagem(FakeObjeto):
+    def __init__(self, id: int, autor, canal, content: str = "", stickers=()):
+        super().__init__(id)
+        self.author = autor
+        self.guild = canal.guild
+        self.channel = canal
+        self.content = content
+        self.stickers = list(stickers)
+        self.created_at = datetime.now(timezone.utc)
+
+    async def delete(self):
+        await rest("apagar_mensagem")
+
+class FakeGuild(FakeObjeto):
+    def __init__(self, id: int):
+        super().__init__(id)
+        self.name = "bench"
+        self.features = []
+        self.default_role = FakeRole(id, "@everyone")
+        self.roles = [self.default_role] + [FakeRole(id + i, nome) for i, nome in enumerate(("soberba", "ira", "inveja", "boost"), 1)]
+        self.voice_channels = []
+        self.text_channels = [FakeCanal(id + 100 + i, f"canal-{i}", self) for i in range(CANAIS - 1)]
+        self.text_channels.append(FakeCanal(id + 100 + CANAIS, "mod-logs", self))
+        self._canais = {c.id: c for c in self.text_channels}
+        self._membros = {}
+        self.chunked = True  # todos os membros do bench estão em _membros
+        self.convites = {}  # código -> usos
+
+    @property
+    def members(self):
+        return list(self._membros.values())
+
+    def cargo(self, nome: str) -> FakeRole:
+        return next(r for r in self.roles if r.name == nome)
+
+    def adicionar(self, membro: FakeMembro) -> FakeMembro:
+        self._membros[membro.id] = membro
+        return membro
+
+    def get_member(self, member_id: int):
+        return self._membros.get(member_id)
+
+    def get_channel(self, channel_id: int):
+        return self._canais.get(channel_id)
+
+    get_channel_or_thread = get_channel
+
+    def get_role(self, role_id: int):
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    async def invites(self):
+        await rest("invites")
+        return [SimpleNamespace(code=codigo, uses=usos, inviter=None) for codigo, usos in self.convites.items()]
+
+    async def ban(self, alvo, reason=None, delete_message_seconds=0):
+        await rest("ban")
+
+    async def bulk_ban(self, alvos, reason=None, delete_message_seconds=0):
+        alvos = list(alvos)
+        await rest("bulk_ban")
+        return SimpleNamespace(banned=[FakeObjeto(a.id) for a in alvos], failed=[])
+
+    async def create_role(self, name=None, permissions=None, reason=None):
+        cargo = FakeRole(self.id + len(self.roles), name)
+        self.roles.append(cargo)
+        return await rest("create_role", cargo)
+
+# ---------------------------------------------------------------------------
+# cenários: cada um devolve a lista de eventos (corrotinas-fábrica) a despachar
+# ---------------------------------------------------------------------------
+
+PALAVRAS = "bom dia alguém viu o jogo ontem que lance absurdo vou jogar mais tarde quem topa hoje não dá amanhã talvez".split()
+
+class Mundo:
+    def __init__(self, main):
+        self.main = main
+        self.rng = random.Random(SEED)
+        self.guild = FakeGuild(10_000)
+        self.canais = [c for c in self.guild.text_channels if c.name != "mod-logs"]
+        self.admin = self.guild.adicionar(FakeMembro(1, self.guild, roles=[self.guild.cargo("soberba")]))
+        self.membros = [self.guild.adicionar(FakeMembro(1000 + i, self.guild)) for i in range(MEMBROS)]
+        self._msg_id = 10 ** 9
+        main.indexar_cargos(self.guild)
+
+    def mensagem(self, autor, content: str = "", stickers=(), canal=None) -> FakeMensagem:
+        self._msg_id += 1
+        return FakeMensagem(self._msg_id, autor, canal or self.rng.choice(self.canais), content, stickers)
+
+    def frase(self) -> str:
+        return " ".join(self.rng.choices(PALAVRAS, k=self.rng.randint(3, 12)))
+
+def cenario_chat_ocioso(mundo: Mundo):
+    # conversa normal: ninguém deveria ser punido
+    for _ in range(4000):
+        msg = mundo.mensagem(mundo.rng.choice(mundo.membros), mundo.frase())
+        yield lambda msg=msg: mundo.main.on_message(msg)
+
+def cenario_figurinhas(mundo: Mundo):
+    # 40 contas mandando 12 figurinhas cada, intercaladas com conversa
+    spammers = mundo.membros[:40]
+    for rodada in range(12):
+        for autor in spammers:
+            msg = mundo.mensagem(autor, stickers=[FakeSticker(5000 + rodada)])
+            yield lambda msg=msg: mundo.main.on_message(msg)
+        for _ in range(40):
+            msg = mundo.mensagem(mundo.rng.choice(mundo.membros[40:]), mundo.frase())
+            yield lambda msg=msg: mundo.main.on_message(msg)
+
+def cenario_repeticao(mundo: Mundo):
+    # 40 contas repetindo a mesma frase no mesmo canal
+    spammers = mundo.membros[:40]
+    textos = {autor.id: mundo.frase() for autor in spammers}
+    for _ in range(8):
+        for autor in spammers:
+            msg = mundo.mensagem(autor, textos[autor.id], canal=mundo.canais[autor.id % len(mundo.canais)])
+            yield lambda msg=msg: mundo.main.on_message(msg)
+        for _ in range(40):
+            msg = mundo.mensagem(mundo.rng.choice(mundo.membros[40:]), mundo.frase())
+            yield lambda msg=msg: mundo.main.on_message(msg)
+
+def cenario_convites(mundo: Mundo):
+    # 100 contas divulgando outro servidor: apaga e muta cada uma
+    for autor in mundo.membros[:100]:
+        msg = mundo.mensagem(autor, f"entra aí discord.gg/outro{autor.id}")
+        yield lambda msg=msg: mundo.main.on_message(msg)
+        msg = mundo.mensagem(mundo.rng.choice(mundo.membros[100:]), mundo.frase())
+        yield lambda msg=msg: mundo.main.on_message(msg)
+
+def cenario_raid(mundo: Mundo):
+    # 500 contas novas entrando pelo mesmo convite em poucos segundos
+    guild = mundo.guild
+    guild.convites["raid"] = 0
+    for i in range(500):
+        membro = FakeMembro(900_000 + i, guild, criado_ha=timedelta(hours=mundo.rng.randint(1, 48)))
+
+        async def entrar(membro=membro):
+            guild.adicionar(membro)
+            guild.convites["raid"] += 1
+            await mundo.main.on_member_join(membro)
+        yield entrar
+
+def cenario_apelidos(mundo: Mundo):
+    # apelidos travados por soberba sendo trocados por outra pessoa
+    main = mundo.main
+    for membro in mundo.membros[:200]:
+        main.blocked_nick[(mundo.guild.id, membro.id)] = f"travado{membro.id}"
+        membro.nick = main.blocked_nick[(mundo.guild.id, membro.id)]
+    for membro in mundo.membros[:200]:
+        antes = SimpleNamespace(nick=membro.nick)
+
+        async def trocar(membro=membro, antes=antes):
+            membro.nick = f"livre{membro.id}"
+            entrada = SimpleNamespace(
+                action=discord.AuditLogAction.member_update,
+                before=SimpleNamespace(nick=antes.nick),
+                after=SimpleNamespace(nick=membro.nick),
+                target=membro,
+                user_id=membro.id,
+                guild=mundo.guild
+            )
+            await main.on_audit_log_entry_create(entrada)
+            await main.on_member_update(antes, membro)
+        yield trocar
+
+def cenario_mute_comando(mundo: Mundo):
+    # .mute do soberba, um alvo por comando (backend padrão: overwrite por canal)
+    main = mundo.main
+
+    async def responder(*args, **kwargs):
+        await rest("send")
+
+    for alvo in mundo.membros[:50]:
+        ctx = SimpleNamespace(author=mundo.admin, guild=mundo.guild, send=responder)
+        yield lambda ctx=ctx, alvo=alvo: main.mute.callback(ctx, 30, usuario=alvo.mention)
+
+CENARIOS = {
+    "chat_ocioso": (cenario_chat_ocioso, False),
+    "figurinhas": (cenario_figurinhas, False),
+    "repeticao": (cenario_repeticao, False),
+    "convites": (cenario_convites, False),
+    "raid": (cenario_raid, True),  # entradas chegam juntas, como o gateway despacha
+    "apelidos": (cenario_apelidos, True),
+    "mute_comando": (cenario_mute_comando, False),
+}
+
+# ---------------------------------------------------------------------------
+# execução de um cenário (processo filho)
+# ---------------------------------------------------------------------------
+
+async def _assentar(main, mundo: Mundo):
+    # espera o que os handlers deixaram agendado: lote do raid, reversões, filas
+    if main.detector_raid.suspeitos.get(mundo.guild.id):
+        await main._punir_suspeitos(mundo.guild)
+    reversoes = list(main._reversoes_nick.values())
+    if reversoes:
+        await asyncio.gather(*reversoes, return_exceptions=True)
+    ag = main.agendador_rest
+    while True:
+        while main.fila_logs.pendentes():
+            await main.fila_logs.flush()
+        if not ag.heap and not ag.bloqueadas and ag.em_curso == 0:
+            break
+        await asyncio.sleep(0.01)
+
+async def _rodar(nome: str, memoria: bool) -> dict:
+    import main
+    main.estado.abrir()
+
+    async def sem_comandos(message):
+        return None
+    main.bot.process_commands = sem_comandos
+
+    mundo = Mundo(main)
+    fabrica, concorrente = CENARIOS[nome]
+    eventos = list(fabrica(mundo))
+    latencias = []
+
+    async def medir(evento):
+        inicio = time.perf_counter()
+        await evento()
+        latencias.append(time.perf_counter() - inicio)
+
+    if memoria:
+        tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+    inicio = time.perf_counter()
+    if concorrente:
+        await asyncio.gather(*(medir(e) for e in eventos))
+    else:
+        for evento in eventos:
+            await medir(evento)
+    duracao = time.perf_counter() - inicio
+    await _assentar(main, mundo)
+
+    resultado = {"cenario": nome, "eventos": len(eventos)}
+    if memoria:
+        depois = tracemalloc.take_snapshot()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        diff = depois.compare_to(antes, "filename")
+        resultado["blocos_retidos"] = sum(d.count_diff for d in diff)
+        resultado["bytes_retidos"] = sum(d.size_diff for d in diff)
+        resultado["pico_bytes"] = pico
+        return resultado
+
+    latencias.sort()
+    resultado.update({
+        "duracao": duracao,
+        "p50": _percentil(latencias, 0.50),
+        "p95": _percentil(latencias, 0.95),
+        "p99": _percentil(latencias, 0.99),
+        "max": latencias[-1] if latencias else 0.0,
+        "rest": dict(rest.chamadas),
+        "regras": {r.nome: r.acertos for r in main.REGRAS_MENSAGEM if r.acertos},
+    })
+    return resultado
+
+def _percentil(ordenadas: list, p: float) -> float:
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))]
+
+def _filho(nome: str, memoria: bool):
+    with tempfile.TemporaryDirectory() as pasta:
+        os.environ["ESTADO_DB"] = os.path.join(pasta, "bench.db")
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        resultado = asyncio.run(_rodar(nome, memoria))
+    print(json.dumps(resultado))
+
+# ---------------------------------------------------------------------------
+# orquestração e relatório
+# ---------------------------------------------------------------------------
+
+def _subprocesso(nome: str, memoria: bool) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--cenario", nome]
+    if memoria:
+        cmd.append("--memoria")
+    saida = subprocess.run(cmd, capture_output=True, text=True, env={**os.environ, "PYTHONHASHSEED": "0"})
+    if saida.returncode != 0:
+        raise RuntimeError(f"cenário {nome} falhou:\n{saida.stderr}")
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+def executar(nomes: list) -> list:
+    resultados = []
+    for nome in nomes:
+        r = _subprocesso(nome, False)
+        m = _subprocesso(nome, True)
+        r["alocacoes_por_evento"] = m["blocos_retidos"] / max(r["eventos"], 1)
+        r["bytes_por_evento"] = m["bytes_retidos"] / max(r["eventos"], 1)
+        r["pico_kib"] = m["pico_bytes"] / 1024
+        resultados.append(r)
+    return resultados
+
+def relatorio(resultados: list, rotas: bool = False) -> str:
+    cab = f"{'cenário':<14}{'eventos':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'máx ms':>9}{'ev/s':>10}{'REST':>7}{'REST/ev':>9}{'aloc/ev':>9}{'B/ev':>8}{'pico KiB':>10}"
+    linhas = [cab, "-" * len(cab)]
+    for r in resultados:
+        total_rest = sum(r["rest"].values())
+        linhas.append(
+            f"{r['cenario']:<14}{r['eventos']:>8}"
+            f"{r['p50'] * 1000:>9.3f}{r['p95'] * 1000:>9.3f}{r['p99'] * 1000:>9.3f}{r['max'] * 1000:>9.1f}"
+            f"{r['eventos'] / r['duracao']:>10.0f}{total_rest:>7}{total_rest / r['eventos']:>9.2f}"
+            f"{r['alocacoes_por_evento']:>9.1f}{r['bytes_por_evento']:>8.0f}{r['pico_kib']:>10.0f}"
+        )
+    if rotas:
+        for r in resultados:
+            detalhes = ", ".join(f"{rota}={n}" for rota, n in sorted(r["rest"].items(), key=lambda kv: -kv[1]))
+            regras = ", ".join(f"{nome}={n}" for nome, n in r["regras"].items())
+            linhas.append(f"\n{r['cenario']}: {detalhes or 'nenhuma chamada'}")
+            if regras:
+                linhas.append(f"  regras: {regras}")
+    return "\n".join(linhas)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="benchmark offline do caminho quente de moderação")
+    parser.add_argument("cenarios", nargs="*", help=f"cenários a rodar (padrão: todos): {', '.join(CENARIOS)}")
+    parser.add_argument("--json", action="store_true", help="uma linha JSON por cenário")
+    parser.add_argument("--rotas", action="store_true", help="mostra as chamadas REST por rota")
+    parser.add_argument("--cenario", help=argparse.SUPPRESS)
+    parser.add_argument("--memoria", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cenario:
+        _filho(args.cenario, args.memoria)
+        return
+
+    desconhecidos = [nome for nome in args.cenarios if nome not in CENARIOS]
+    if desconhecidos:
+        parser.error(f"cenário desconhecido: {', '.join(desconhecidos)}")
+    resultados = executar(args.cenarios or list(CENARIOS))
+    if args.json:
+        for r in resultados:
+            print(json.dumps(r))
+    else:
+        print(relatorio(resultados, args.rotas))
+
+if __name__ == "__main__":
+    main_cli()
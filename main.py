@@ -1,14 +1,26 @@
 import os
 import re
+import heapq
 import json
 import time
 import asyncio
 import random
+import sqlite3
+import sys
+import subprocess
+import itertools
+import bisect
+import functools
+import contextvars
+import threading
+import traceback
+import logging
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 
 import discord
 from discord.ext import commands, tasks
+from aiohttp import web
 
 intents = discord.Intents.default()
 intents.members = True
@@ -16,50 +28,407 @@ intents.message_content = True
 intents.guilds = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix=".", intents=intents)
+# 🆕 SHARDS (AutoShardedBot opcional; vários processos dividem os shards e o mesmo SQLite)
+AUTO_SHARD = os.getenv("AUTO_SHARD", "0") == "1"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None  # None: o Discord recomenda
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None  # None: todos
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))  # >1: este processo só supervisiona os workers
+
+def shard_da_guild(guild_id: int, total: int) -> int:
+    # mesma fórmula do gateway
+    return (guild_id >> 22) % total
+
+# 🆕 PERFIL DE CACHE ("enxuto" para servidores grandes: sem cache de mensagens e membros só quando preciso)
+PERFIL_CACHE = os.getenv("PERFIL_CACHE", "padrao")
+ORCAMENTO_RSS_MB = int(os.getenv("ORCAMENTO_RSS_MB", "0"))  # 0: sem orçamento; só aparece no .memoria
+if PERFIL_CACHE == "enxuto":
+    # as regras usam os registros compactos de EstadoUsuario, não o cache de mensagens da lib
+    MAX_MENSAGENS = int(os.getenv("MAX_MENSAGENS", "0")) or None
+    # só voice (membros_em_voz / mutecall). Sem joined, o chunk(cache=False) do .massa não
+    # enche o cache; quem entra, raid e quarentena são resolvidos por id (obter_membros)
+    cache_membros = discord.MemberCacheFlags.none()
+    cache_membros.voice = True
+else:
+    MAX_MENSAGENS = int(os.getenv("MAX_MENSAGENS", "1000")) or None
+    cache_membros = discord.MemberCacheFlags.from_intents(intents)
+
+# 429 curto a lib repete sozinha (e a contagem vem do log dela); acima disto vira RateLimited
+# e o agendador REST segura o bucket. 30s é o mínimo que a lib aceita
+REST_LIMITE_429 = 30.0
+
+# membros são carregados sob demanda (obter_membro / obter_membros / listar_membros), não antes do ready
+if AUTO_SHARD:
+    bot = commands.AutoShardedBot(command_prefix=".", intents=intents, chunk_guilds_at_startup=False, max_messages=MAX_MENSAGENS, member_cache_flags=cache_membros, max_ratelimit_timeout=REST_LIMITE_429, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix=".", intents=intents, chunk_guilds_at_startup=False, max_messages=MAX_MENSAGENS, member_cache_flags=cache_membros, max_ratelimit_timeout=REST_LIMITE_429)
+
+# 🆕 ESTADO PERSISTENTE (SQLite em WAL, gravação em lote em segundo plano)
+ESTADO_DB = os.getenv("ESTADO_DB", "illumi_estado.db")
+ESTADO_FLUSH_INTERVALO = 2.0
+
+_CHAVE_INT = (str, int)
+_CHAVE_PAR = (lambda k: ":".join(str(i) for i in sorted(k)), lambda s: frozenset(int(i) for i in s.split(":")))
+_CHAVE_TUPLA = (lambda k: ":".join(str(i) for i in k), lambda s: tuple(int(i) for i in s.split(":")))
+_VALOR_JSON = (json.dumps, json.loads)
+_VALOR_DATA = (datetime.isoformat, datetime.fromisoformat)
+
+# de qual servidor é a linha (para cada worker carregar só os seus)
+_GUILD_CHAVE = lambda k: k
+_GUILD_TUPLA = lambda k: k[0]
+
+class TabelaPersistente(dict):
+    # dict comum que anota as chaves alteradas; o flusher grava só essas
+    __slots__ = ("nome", "codec_chave", "codec_valor", "guild", "sujos")
+
+    def __init__(self, nome: str, codec_chave=_CHAVE_INT, codec_valor=_VALOR_JSON, guild=None):
+        super().__init__()
+        self.nome = nome
+        self.codec_chave = codec_chave
+        self.codec_valor = codec_valor
+        self.guild = guild  # chave -> guild_id, para tabelas particionadas por servidor
+        self.sujos = set()
+
+    def marcar(self, chave):
+        # para valores mutáveis alterados no lugar (listas, dicts)
+        self.sujos.add(chave)
+
+    def __setitem__(self, chave, valor):
+        super().__setitem__(chave, valor)
+        self.sujos.add(chave)
+
+    def __delitem__(self, chave):
+        super().__delitem__(chave)
+        self.sujos.add(chave)
+
+    def pop(self, chave, *padrao):
+        if chave in self:
+            self.sujos.add(chave)
+        return super().pop(chave, *padrao)
+
+    def popitem(self):
+        chave, valor = super().popitem()
+        self.sujos.add(chave)
+        return chave, valor
+
+    def setdefault(self, chave, padrao=None):
+        if chave not in self:
+            self[chave] = padrao
+        return self[chave]
+
+    def update(self, *args, **kwargs):
+        for chave, valor in dict(*args, **kwargs).items():
+            self[chave] = valor
+
+    def clear(self):
+        self.sujos.update(self.keys())
+        super().clear()
+
+class EstadoPersistente:
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.tabelas = {}
+        self.conn = None
+        self._lock = asyncio.Lock()
+        self.ultimo_flush = 0.0
+        self.linhas_gravadas = 0
+        self.filtro_guild = None  # guild_id -> bool; com shards em processos, só carrega os servidores daqui
+
+    def tabela(self, nome: str, codec_chave=_CHAVE_INT, codec_valor=_VALOR_JSON, guild=None) -> TabelaPersistente:
+        t = TabelaPersistente(nome, codec_chave, codec_valor, guild)
+        self.tabelas[nome] = t
+        return t
+
+    def abrir(self):
+        if self.conn is not None:
+            return
+        # timeout: outros workers de shard podem estar gravando no mesmo arquivo
+        self.conn = sqlite3.connect(self.caminho, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS estado ("
+            "tabela TEXT NOT NULL, chave TEXT NOT NULL, valor TEXT NOT NULL, "
+            "PRIMARY KEY (tabela, chave)) WITHOUT ROWID"
+        )
+
+    def carregar(self) -> int:
+        # uma única leitura sequencial; nada é marcado como sujo
+        self.abrir()
+        total = 0
+        for nome, chave, valor in self.conn.execute("SELECT tabela, chave, valor FROM estado"):
+            t = self.tabelas.get(nome)
+            if t is None:
+                continue
+            try:
+                chave = t.codec_chave[1](chave)
+                if self.filtro_guild is not None and t.guild is not None and not self.filtro_guild(t.guild(chave)):
+                    continue
+                dict.__setitem__(t, chave, t.codec_valor[1](valor))
+                total += 1
+            except Exception:
+                pass
+        return total
+
+    def _coletar(self):
+        upserts, deletes, chaves = [], [], []
+        for t in self.tabelas.values():
+            if not t.sujos:
+                continue
+            sujos, t.sujos = t.sujos, set()
+            for chave in sujos:
+                chaves.append((t, chave))
+                try:
+                    if dict.__contains__(t, chave):
+                        upserts.append((t.nome, t.codec_chave[0](chave), t.codec_valor[0](dict.__getitem__(t, chave))))
+                    else:
+                        deletes.append((t.nome, t.codec_chave[0](chave)))
+                except Exception:
+                    pass
+        return upserts, deletes, chaves
 
-PAIR_COOLDOWNS = {}
+    def _gravar(self, upserts, deletes):
+        self.conn.execute("BEGIN")
+        try:
+            if upserts:
+                self.conn.executemany("INSERT OR REPLACE INTO estado (tabela, chave, valor) VALUES (?, ?, ?)", upserts)
+            if deletes:
+                self.conn.executemany("DELETE FROM estado WHERE tabela = ? AND chave = ?", deletes)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> int:
+        if self.conn is None:
+            return 0
+        async with self._lock:
+            upserts, deletes, chaves = self._coletar()
+            if not chaves:
+                return 0
+            try:
+                await asyncio.to_thread(self._gravar, upserts, deletes)
+            except Exception:
+                for t, chave in chaves:
+                    t.sujos.add(chave)
+                return 0
+            self.ultimo_flush = time.time()
+            self.linhas_gravadas += len(chaves)
+            return len(chaves)
+
+    def flush_sync(self):
+        if self.conn is None:
+            return
+        upserts, deletes, chaves = self._coletar()
+        if chaves:
+            self._gravar(upserts, deletes)
+
+    def pendentes(self) -> int:
+        return sum(len(t.sujos) for t in self.tabelas.values())
+
+estado = EstadoPersistente(ESTADO_DB)
+
+PAIR_COOLDOWNS = estado.tabela("pair_cooldowns", _CHAVE_PAR)
 PAIR_COOLDOWN_SECONDS = 3 * 60
 ACCEPT_TIMEOUT = 60
 CHANNEL_DURATION = 7 * 60
 SAFETY_TIMEOUT = 60 * 30
 
-antilink_ativo = True
-text_mutes = {}
-invite_cache = {}
-convites_por_usuario = {}
+antilink_por_guild = estado.tabela("antilink", guild=_GUILD_CHAVE)  # guild_id -> False quando desligado; sem linha = ligado
+text_mutes = estado.tabela("text_mutes", _CHAVE_TUPLA, _VALOR_DATA, _GUILD_TUPLA)  # (guild_id, user_id) -> fim
+invite_cache = estado.tabela("invite_cache", guild=_GUILD_CHAVE)
 
 user_genders = {}
 user_preferences = {}
 
 FLOOD_LIMIT = 10
 FLOOD_WINDOW = 10.0
-user_msg_times = defaultdict(lambda: deque())
 
 SHORT_MSG_LIMIT = 5
 SHORT_MSG_WINDOW = 10.0
-user_short_msgs = defaultdict(lambda: deque())
+
+# 🆕 JANELA DESLIZANTE DE REPETIÇÃO (só ids e hashes; contagem incremental por chave)
+JANELA_MAX_ENTRADAS = 32
+
+class JanelaRepeticao:
+    __slots__ = ("janela", "entradas", "contagem")
+
+    def __init__(self, janela: float):
+        self.janela = janela
+        self.entradas = deque()  # (timestamp, chave, message_id, channel_id)
+        self.contagem = {}  # chave -> ocorrências dentro da janela
+
+    def _descartar_primeira(self):
+        _, chave, _, _ = self.entradas.popleft()
+        n = self.contagem[chave] - 1
+        if n:
+            self.contagem[chave] = n
+        else:
+            del self.contagem[chave]
+
+    def expirar(self, now: float):
+        while self.entradas and now - self.entradas[0][0] > self.janela:
+            self._descartar_primeira()
+
+    def adicionar(self, now: float, chave, message_id: int, channel_id: int) -> int:
+        self.expirar(now)
+        if len(self.entradas) >= JANELA_MAX_ENTRADAS:
+            self._descartar_primeira()
+        self.entradas.append((now, chave, message_id, channel_id))
+        n = self.contagem.get(chave, 0) + 1
+        self.contagem[chave] = n
+        return n
+
+    def mensagens(self, chave) -> list:
+        return [(channel_id, message_id) for _, k, message_id, channel_id in self.entradas if k == chave]
+
+    def limpar(self):
+        self.entradas.clear()
+        self.contagem.clear()
+
+    def __len__(self):
+        return len(self.entradas)
 
 # 🆕 SISTEMA PARA FIGURINHAS
 STICKER_FLOOD_LIMIT = 8  # +8 figurinhas diferentes em 10s = MUTE
 STICKER_REPEAT_LIMIT = 5  # +5 figurinhas IGUAIS em 15s = MUTE
-user_sticker_times = defaultdict(lambda: deque())
-user_sticker_repeats = defaultdict(list)  # Para figurinhas repetidas
-last_sticker = {}  # Última figurinha enviada
-
-last_msg = {}
-last_msg_time = {}
-repeat_count = defaultdict(int)
-mute_level = defaultdict(int)
-user_repeat_msgs = defaultdict(list)
+STICKER_REPEAT_WINDOW = 15.0
+
+REPEAT_LIMIT = 5
+REPEAT_WINDOW = 15.0
+mute_level = estado.tabela("mute_level", _CHAVE_TUPLA, guild=_GUILD_TUPLA)  # (guild_id, user_id); persistido, não é despejado com o resto
+
+# 🆕 ESTADO POR USUÁRIO (um registro compacto por usuário, despejado por TTL/LRU)
+USUARIOS_TTL = 5 * 60  # bem acima da maior janela (15s)
+USUARIOS_MAX = 50_000  # teto de memória: acima disso sai o menos recente
+USUARIOS_VARREDURA = 60
+RECENTES_MAX = 50  # últimas mensagens por usuário, em qualquer canal
+LIMPEZA_JANELA = 60.0
+
+MSG_FIGURINHA = 1
+MSG_CURTA = 2
+
+class EstadoUsuario:
+    # contêineres só são criados quando a regra precisa deles
+    __slots__ = ("visto", "comandos", "curtas", "figurinhas", "figurinhas_repetidas", "repeticao", "ultima_msg", "recentes")
+
+    def __init__(self, now: float):
+        self.visto = now
+        self.comandos = None  # deque de timestamps de comandos
+        self.curtas = None  # deque de timestamps de mensagens curtas
+        self.figurinhas = None  # deque de timestamps de figurinhas
+        self.figurinhas_repetidas = None  # JanelaRepeticao por sticker_id
+        self.repeticao = None  # JanelaRepeticao por hash de conteúdo
+        self.ultima_msg = None  # hash do último conteúdo normalizado
+        self.recentes = None  # deque de (timestamp, channel_id, message_id, flags)
+
+    def registrar_mensagem(self, now: float, channel_id: int, message_id: int, flags: int):
+        if self.recentes is None:
+            self.recentes = deque(maxlen=RECENTES_MAX)
+        self.recentes.append((now, channel_id, message_id, flags))
+
+    def recentes_na_janela(self, now: float, janela: float, flag: int = 0) -> list:
+        if not self.recentes:
+            return []
+        return [
+            (channel_id, message_id) for ts, channel_id, message_id, flags in self.recentes
+            if now - ts <= janela and (not flag or flags & flag)
+        ]
+
+    def retirar_recentes(self, message_ids):
+        if self.recentes:
+            message_ids = set(message_ids)
+            self.recentes = deque((e for e in self.recentes if e[2] not in message_ids), maxlen=RECENTES_MAX)
+
+    def tamanho_estimado(self) -> int:
+        total = sys.getsizeof(self)
+        if self.recentes is not None:
+            total += sys.getsizeof(self.recentes) + len(self.recentes) * 88
+        for nome in ("comandos", "curtas", "figurinhas"):
+            dq = getattr(self, nome)
+            if dq is not None:
+                total += sys.getsizeof(dq)
+        for janela in (self.figurinhas_repetidas, self.repeticao):
+            if janela is not None:
+                total += sys.getsizeof(janela) + sys.getsizeof(janela.entradas) + sys.getsizeof(janela.contagem)
+                total += len(janela.entradas) * 88
+        return total
+
+class TabelaUsuarios:
+    def __init__(self, ttl: float, maximo: int):
+        self.ttl = ttl
+        self.maximo = maximo
+        self.registros = OrderedDict()  # user_id -> EstadoUsuario, do menos para o mais recente
+        self.despejos_ttl = 0
+        self.despejos_lru = 0
+
+    def obter(self, user_id: int, now: float) -> EstadoUsuario:
+        rec = self.registros.get(user_id)
+        if rec is None:
+            rec = self.registros[user_id] = EstadoUsuario(now)
+            if len(self.registros) > self.maximo:
+                self.registros.popitem(last=False)
+                self.despejos_lru += 1
+        else:
+            self.registros.move_to_end(user_id)
+            rec.visto = now
+        return rec
+
+    def varrer(self, now: float) -> int:
+        # a ordem é de acesso, então os ociosos estão todos no começo
+        removidos = 0
+        while self.registros:
+            user_id, rec = next(iter(self.registros.items()))
+            if now - rec.visto <= self.ttl:
+                break
+            del self.registros[user_id]
+            removidos += 1
+        self.despejos_ttl += removidos
+        return removidos
+
+    def memoria_estimada(self, amostra: int = 500) -> int:
+        if not self.registros:
+            return 0
+        recs = list(itertools.islice(reversed(self.registros.values()), amostra))
+        media = sum(r.tamanho_estimado() for r in recs) / len(recs)
+        return int(media * len(self.registros) + sys.getsizeof(self.registros))
+
+    def __len__(self):
+        return len(self.registros)
+
+usuarios = TabelaUsuarios(USUARIOS_TTL, USUARIOS_MAX)
+
+class IndiceRecentes:
+    # message_id -> (guild_id, user_id) só enquanto a mensagem pode entrar numa limpeza;
+    # é o que deixa os eventos raw de delete acharem o dono sem o cache de mensagens
+    def __init__(self, janela: float):
+        self.janela = janela
+        self.donos = {}
+        self.ordem = deque()  # (timestamp, message_id), do mais antigo para o mais novo
+
+    def adicionar(self, now: float, message_id: int, dono: tuple):
+        self.donos[message_id] = dono
+        self.ordem.append((now, message_id))
+        while self.ordem and now - self.ordem[0][0] > self.janela:
+            self.donos.pop(self.ordem.popleft()[1], None)
+
+    def retirar(self, message_ids) -> dict:
+        por_dono = defaultdict(list)
+        for message_id in message_ids:
+            dono = self.donos.pop(message_id, None)
+            if dono is not None:
+                por_dono[dono].append(message_id)
+        return por_dono
+
+    def __len__(self):
+        return len(self.donos)
+
+indice_recentes = IndiceRecentes(LIMPEZA_JANELA)
 
 active_users = set()
 active_channels = {}
 
-blocked_nick = {}
+blocked_nick = estado.tabela("blocked_nick", _CHAVE_TUPLA, guild=_GUILD_TUPLA)  # (guild_id, user_id) -> apelido travado
 
-mute_call_ativo = False
-mute_all_ativo = False
 
 CHANNEL_BASE = "pecadores"
 
@@ -68,35 +437,96 @@ SETUP_CHANNELS = {}
 music_queues = {}
 music_players = {}
 
-def tem_cargo_soberba(member: discord.Member) -> bool:
+# 🆕 ÍNDICE DE CARGOS POR SERVIDOR (nome -> ids; checagem por member._roles)
+CARGOS_INDEXADOS = ("soberba", "ira", "inveja", "boost")
+CARGOS_ADMIN = ("soberba", "ira")
+
+cargos_por_guild = {}  # guild_id -> {nome: frozenset(role_ids)}
+
+def indexar_cargos(guild: discord.Guild) -> dict:
+    indice = {nome: set() for nome in CARGOS_INDEXADOS}
+    for r in guild.roles:
+        ids = indice.get(r.name.lower())
+        if ids is not None:
+            ids.add(r.id)
+    indice = {nome: frozenset(ids) for nome, ids in indice.items()}
+    indice["admin"] = frozenset().union(*(indice[nome] for nome in CARGOS_ADMIN))
+    cargos_por_guild[guild.id] = indice
+    return indice
+
+def _tem_cargo(member: discord.Member, nome: str) -> bool:
     try:
-        return any(r.name.lower() == "soberba" for r in member.roles)
+        indice = cargos_por_guild.get(member.guild.id) or indexar_cargos(member.guild)
+        ids = indice[nome]
+        if not ids:
+            return False
+        roles = member._roles
+        return any(roles.has(role_id) for role_id in ids)
     except Exception:
         return False
 
+def tem_cargo_soberba(member: discord.Member) -> bool:
+    return _tem_cargo(member, "soberba")
+
 def tem_cargo_ira(member: discord.Member) -> bool:
-    try:
-        return any(r.name.lower() == "ira" for r in member.roles)
-    except Exception:
-        return False
+    return _tem_cargo(member, "ira")
 
 def tem_cargo_inveja(member: discord.Member) -> bool:
-    try:
-        return any(r.name.lower() == "inveja" for r in member.roles)
-    except Exception:
-        return False
+    return _tem_cargo(member, "inveja")
 
 def tem_cargo_boost(member: discord.Member) -> bool:
-    try:
-        return any(r.name.lower() == "boost" for r in member.roles)
-    except Exception:
-        return False
+    return _tem_cargo(member, "boost")
 
 def tem_cargo_admin(member: discord.Member) -> bool:
-    try:
-        return any(r.name.lower() in ["soberba", "ira"] for r in member.roles)
-    except Exception:
-        return False
+    return _tem_cargo(member, "admin")
+
+# 🆕 DIRETÓRIO DE CANAIS POR SERVIDOR (nome -> id, mantido pelos eventos de canal)
+LOG_CHANNEL_NAME = "mod-logs"
+
+class DiretorioCanais:
+    __slots__ = ("por_nome", "texto")
+
+    def __init__(self, guild: discord.Guild):
+        self.por_nome = {}  # nome -> set(channel_ids)
+        self.texto = {}  # channel_id -> nome
+        for canal in guild.text_channels:
+            self.adicionar(canal)
+
+    def adicionar(self, canal: discord.TextChannel):
+        self.texto[canal.id] = canal.name
+        self.por_nome.setdefault(canal.name, set()).add(canal.id)
+
+    def remover(self, canal_id: int):
+        nome = self.texto.pop(canal_id, None)
+        if nome is None:
+            return
+        ids = self.por_nome.get(nome)
+        if ids is not None:
+            ids.discard(canal_id)
+            if not ids:
+                del self.por_nome[nome]
+
+diretorios_canais = {}  # guild_id -> DiretorioCanais
+
+def diretorio_canais(guild: discord.Guild) -> DiretorioCanais:
+    d = diretorios_canais.get(guild.id)
+    if d is None:
+        d = diretorios_canais[guild.id] = DiretorioCanais(guild)
+    return d
+
+def canal_por_nome(guild: discord.Guild, nome: str):
+    for canal_id in diretorio_canais(guild).por_nome.get(nome, ()):
+        canal = guild.get_channel(canal_id)
+        if canal is not None:
+            return canal
+    return None
+
+def canal_log_de(guild: discord.Guild):
+    return canal_por_nome(guild, LOG_CHANNEL_NAME)
+
+def canais_texto(guild: discord.Guild) -> list:
+    # mesma coleção de guild.text_channels, sem reordenar a cada chamada
+    return [c for canal_id in diretorio_canais(guild).texto if (c := guild.get_channel(canal_id)) is not None]
 
 def is_exempt(member: discord.Member) -> bool:
     return member.bot or tem_cargo_admin(member)
@@ -136,115 +566,1030 @@ def format_tempo(minutos: int) -> str:
     
     return " e ".join(partes)
 
-async def aplicar_mute_texto(guild: discord.Guild, member: discord.Member, minutos: int, motivo: str = None, canal_log: discord.TextChannel = None):
-    fim = datetime.utcnow() + timedelta(minutes=minutos)
-    
-    canais_afetados = 0
-    for canal in guild.text_channels:
+# 🆕 MÉTRICAS (texto Prometheus num endpoint local, servido pelo aiohttp do discord.py)
+METRICAS_HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", "9108"))  # 0 desliga o endpoint
+METRICAS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _rotulos(nomes, valores) -> str:
+    if not nomes:
+        return ""
+    partes = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nome}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.valores = defaultdict(float)
+
+    def inc(self, *valores, n: float = 1):
+        self.valores[valores] += n
+
+    def amostras(self):
+        for valores, v in self.valores.items():
+            yield self.nome, _rotulos(self.rotulos, valores), v
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos=(), buckets=METRICAS_BUCKETS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = buckets
+        self.series = {}  # valores dos rótulos -> [contagem por bucket (+Inf no fim), soma, total]
+
+    def observar(self, segundos: float, *valores):
+        serie = self.series.get(valores)
+        if serie is None:
+            serie = self.series[valores] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        serie[0][bisect.bisect_left(self.buckets, segundos)] += 1
+        serie[1] += segundos
+        serie[2] += 1
+
+    def amostras(self):
+        nomes_le = self.rotulos + ("le",)
+        for valores, (contagens, soma, total) in self.series.items():
+            acumulado = 0
+            for limite, n in zip(self.buckets + ("+Inf",), contagens):
+                acumulado += n
+                yield f"{self.nome}_bucket", _rotulos(nomes_le, valores + (limite,)), acumulado
+            yield f"{self.nome}_sum", _rotulos(self.rotulos, valores), soma
+            yield f"{self.nome}_count", _rotulos(self.rotulos, valores), total
+
+class Coletor:
+    # série calculada na hora da coleta a partir do estado que já existe
+    def __init__(self, nome: str, tipo: str, ajuda: str, rotulos, funcao):
+        self.nome = nome
+        self.tipo = tipo
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.funcao = funcao
+
+    def amostras(self):
+        for valores, v in self.funcao():
+            yield self.nome, _rotulos(self.rotulos, valores), v
+
+class Metricas:
+    def __init__(self):
+        self.itens = []
+
+    def registrar(self, item):
+        self.itens.append(item)
+        return item
+
+    def renderizar(self) -> str:
+        linhas = []
+        for item in self.itens:
+            linhas.append(f"# HELP {item.nome} {item.ajuda}")
+            linhas.append(f"# TYPE {item.nome} {item.tipo}")
+            try:
+                for nome, rotulos, v in item.amostras():
+                    linhas.append(f"{nome}{rotulos} {v:g}" if isinstance(v, float) else f"{nome}{rotulos} {v}")
+            except Exception:
+                pass
+        return "\n".join(linhas) + "\n"
+
+metricas = Metricas()
+
+def coletado(nome: str, tipo: str, ajuda: str, rotulos=()):
+    def registrar(func):
+        metricas.registrar(Coletor(nome, tipo, ajuda, rotulos, func))
+        return func
+    return registrar
+
+latencia_handlers = metricas.registrar(Histograma("illumi_handler_segundos", "duração de eventos, comandos e ações de mute", ("tipo", "nome")))
+erros_handlers = metricas.registrar(Contador("illumi_handler_erros_total", "exceções que escaparam de eventos, comandos e ações", ("tipo", "nome")))
+acoes_por_regra = metricas.registrar(Contador("illumi_acoes_total", "chamadas REST submetidas, pela regra que as disparou", ("regra", "rota")))
+espera_rest = metricas.registrar(Histograma("illumi_rest_espera_segundos", "tempo na fila do agendador REST até a chamada começar", ("rota",)))
+
+regra_atual = contextvars.ContextVar("regra_atual", default="nenhuma")
+
+def medido(tipo: str):
+    """Registra duração e exceções de um handler async em illumi_handler_*."""
+    def decorar(func):
+        nome = func.__name__
+
+        @functools.wraps(func)
+        async def envolvido(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                erros_handlers.inc(tipo, nome)
+                raise
+            finally:
+                latencia_handlers.observar(time.perf_counter() - inicio, tipo, nome)
+        return envolvido
+    return decorar
+
+# 🆕 WATCHDOG DO EVENT LOOP (atraso do loop e quem estava rodando quando ele travou)
+WATCHDOG_INTERVALO = 0.1  # batida do loop e período da thread vigia
+WATCHDOG_LIMIAR = 0.5  # atraso a partir do qual conta como travamento
+WATCHDOG_REGISTROS = 50  # travamentos guardados para o .travamentos
+WATCHDOG_QUADROS = 30  # quadros mais internos guardados da pilha
+
+atraso_loop = metricas.registrar(Histograma("illumi_loop_atraso_segundos", "atraso do event loop medido a cada batida"))
+travamentos_por_handler = metricas.registrar(Contador("illumi_travamentos_total", "travamentos do loop, pelo handler que estava rodando", ("handler",)))
+
+class Travamento:
+    __slots__ = ("inicio", "duracao", "handler", "regra", "pilha")
+
+    def __init__(self, inicio: float, handler: str, regra: str, pilha: list):
+        self.inicio = inicio  # time.time() de quando o loop parou de bater
+        self.duracao = None  # preenchida quando o loop volta
+        self.handler = handler
+        self.regra = regra
+        self.pilha = pilha
+
+def _quem_rodava(quadro) -> tuple:
+    # sobe a pilha do loop: cada @medido deixa um quadro "envolvido" com tipo/nome nos locais
+    handlers, regra = [], None
+    while quadro is not None:
+        codigo = quadro.f_code
+        if quadro.f_globals is globals():
+            if codigo.co_name == "envolvido":
+                handlers.append(f"{quadro.f_locals.get('tipo')}:{quadro.f_locals.get('nome')}")
+            elif codigo.co_name == "executar_regras" and regra is None:
+                r = quadro.f_locals.get("r")
+                regra = getattr(r, "nome", None)
+        quadro = quadro.f_back
+    return " > ".join(reversed(handlers)) or "?", regra
+
+class WatchdogLoop:
+    """Mede o atraso do loop com uma batida async e vigia a batida de uma thread.
+
+    Se a batida para por mais que o limiar, a thread tira uma amostra da pilha do
+    loop (o código que está segurando o loop naquele instante) e guarda no anel;
+    quando o loop volta, a batida completa a duração do travamento.
+    """
+
+    def __init__(self):
+        self.batida = time.monotonic()
+        self.registros = deque(maxlen=WATCHDOG_REGISTROS)
+        self.atual = None  # travamento visto pela thread e ainda em curso
+        self.maior_atraso = 0.0
+        self._ident_loop = None
+        self._task = None
+        self._thread = None
+
+    def iniciar(self):
+        if self._task is None or self._task.done():
+            self._ident_loop = threading.get_ident()
+            self.batida = time.monotonic()
+            self._task = asyncio.create_task(self._bater())
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._vigiar, name="watchdog-loop", daemon=True)
+            self._thread.start()
+
+    async def _bater(self):
+        while True:
+            antes = time.monotonic()
+            await asyncio.sleep(WATCHDOG_INTERVALO)
+            agora = time.monotonic()
+            self.batida = agora
+            atraso = max(agora - antes - WATCHDOG_INTERVALO, 0.0)
+            atraso_loop.observar(atraso)
+            self.maior_atraso = max(self.maior_atraso, atraso)
+            travamento = self.atual
+            if travamento is not None:
+                travamento.duracao = atraso
+                self.atual = None
+            elif atraso >= WATCHDOG_LIMIAR:
+                # curto demais para a thread ver; fica registrado sem pilha
+                self._registrar(Travamento(time.time() - atraso, "?", None, []))
+                self.registros[-1].duracao = atraso
+
+    def _registrar(self, travamento: Travamento):
+        self.registros.append(travamento)
+        travamentos_por_handler.inc(travamento.handler)
+
+    def _vigiar(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVALO)
+            parado = time.monotonic() - self.batida - WATCHDOG_INTERVALO
+            if parado < WATCHDOG_LIMIAR or self.atual is not None:
+                continue
+            quadro = sys._current_frames().get(self._ident_loop)
+            if quadro is None:
+                continue
+            try:
+                handler, regra = _quem_rodava(quadro)
+                pilha = traceback.format_list(traceback.extract_stack(quadro, limit=WATCHDOG_QUADROS))
+            except Exception:
+                handler, regra, pilha = "?", None, []
+            finally:
+                del quadro
+            self.atual = Travamento(time.time() - parado, handler, regra, pilha)
+            self._registrar(self.atual)
+
+watchdog_loop = WatchdogLoop()
+
+# 🆕 FILA DE LOGS (mod-logs em lote, sem travar quem está punindo)
+LOG_ALTA = 0
+LOG_NORMAL = 1
+LOG_BAIXA = 2
+
+LOG_FLUSH_INTERVALO = 1.5
+LOG_EMBEDS_POR_MENSAGEM = 10
+LOG_CARACTERES_POR_MENSAGEM = 6000  # limite do Discord para a soma dos embeds de uma mensagem
+LOG_MENSAGENS_POR_FLUSH = 2  # por canal; o resto espera o próximo ciclo
+LOG_FILA_MAX = 200  # por canal; acima disso descarta o menos importante
+
+class FilaLogs:
+    def __init__(self):
+        self.filas = {}  # channel_id -> [canal, heap de (prioridade, seq, embed, conteudo)]
+        self._seq = 0
+        self._task = None
+        self.enviados = 0
+        self.descartados = 0
+        self._descartados_por_canal = defaultdict(int)
+
+    def enfileirar(self, canal, embed: discord.Embed = None, conteudo: str = None, prioridade: int = LOG_NORMAL):
+        if canal is None or (embed is None and not conteudo):
+            return
+        entrada = self.filas.get(canal.id)
+        if entrada is None:
+            entrada = self.filas[canal.id] = [canal, []]
+        heap = entrada[1]
+        self._seq += 1
+        heapq.heappush(heap, (prioridade, self._seq, embed, conteudo))
+        if len(heap) > LOG_FILA_MAX:
+            # sob pressão, some o log de menor prioridade (o mais novo dentre eles)
+            pior = max(range(len(heap)), key=lambda i: (heap[i][0], heap[i][1]))
+            heap[pior] = heap[-1]
+            heap.pop()
+            heapq.heapify(heap)
+            self.descartados += 1
+            self._descartados_por_canal[canal.id] += 1
+        self.iniciar()
+
+    def pendentes(self) -> int:
+        return sum(len(heap) for _, heap in self.filas.values())
+
+    def iniciar(self):
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._rodar())
+            except RuntimeError:
+                pass
+
+    async def _rodar(self):
+        while self.filas:
+            await asyncio.sleep(LOG_FLUSH_INTERVALO)
+            await self.flush()
+
+    def _montar(self, canal_id: int, heap: list):
+        embeds, conteudos, lote = [], [], []
+        tamanho, caracteres = 0, 0
+        descartados = self._descartados_por_canal.pop(canal_id, 0)
+        if descartados:
+            aviso = f"⚠️ {descartados} logs descartados por excesso de eventos."
+            conteudos.append(aviso)
+            tamanho += len(aviso) + 1
+        while heap and len(embeds) < LOG_EMBEDS_POR_MENSAGEM:
+            _, _, embed, conteudo = heap[0]
+            if conteudo and conteudos and tamanho + len(conteudo) + 1 > 2000:
+                break
+            # um embed sozinho acima do limite ainda sai (e falha) sozinho, sem levar os outros junto
+            if embed is not None and embeds and caracteres + len(embed) > LOG_CARACTERES_POR_MENSAGEM:
+                break
+            if conteudo:
+                conteudos.append(conteudo[:2000])
+                tamanho += len(conteudo) + 1
+            if embed is not None:
+                embeds.append(embed)
+                caracteres += len(embed)
+            lote.append(heapq.heappop(heap))
+        return "\n".join(conteudos) or None, embeds, lote, descartados
+
+    async def flush(self):
+        for canal_id, (canal, heap) in list(self.filas.items()):
+            for _ in range(LOG_MENSAGENS_POR_FLUSH):
+                if not heap:
+                    break
+                conteudo, embeds, lote, descartados = self._montar(canal_id, heap)
+                try:
+                    await agendador_rest.executar(
+                        lambda: canal.send(content=conteudo, embeds=embeds),
+                        rota="log",
+                        prioridade=REST_LOG,
+                        bucket=canal.id
+                    )
+                    self.enviados += 1
+                except Exception as e:
+                    if isinstance(e, discord.HTTPException) and 400 <= e.status < 500 and e.status != 429:
+                        # sem permissão, canal apagado ou payload recusado: tentar de novo não adianta
+                        self.descartados += len(lote)
+                        self._descartados_por_canal[canal_id] += descartados + len(lote)
+                    else:
+                        # falha passageira: o lote volta para a fila e o canal espera o próximo ciclo
+                        for item in lote:
+                            heapq.heappush(heap, item)
+                        self._descartados_por_canal[canal_id] += descartados
+                        break
+            if not heap:
+                del self.filas[canal_id]
+
+fila_logs = FilaLogs()
+
+def enviar_log(canal_log, embed: discord.Embed = None, conteudo: str = None, prioridade: int = LOG_NORMAL):
+    fila_logs.enfileirar(canal_log, embed=embed, conteudo=conteudo, prioridade=prioridade)
+
+# 🆕 AGENDADOR REST (toda chamada de moderação passa por aqui, em ordem de prioridade)
+REST_PUNICAO = 0  # ban, kick, apagar mensagem
+REST_MUTE = 1  # mutes, permissões de canal, apelidos
+REST_AVISO = 2  # avisos no canal, limpeza de canais
+REST_LOG = 3  # mod-logs
+REST_PRIORIDADES = ("punição", "mute", "aviso", "log")
+
+REST_WORKERS = 8
+REST_MAX_TENTATIVAS = 3
+REST_AMOSTRAS = 256  # esperas recentes guardadas por rota
+
+class RotaREST:
+    __slots__ = ("chamadas", "falhas", "limitadas", "deduplicadas", "esperas", "duracao")
+
+    def __init__(self):
+        self.chamadas = 0
+        self.falhas = 0
+        self.limitadas = 0  # respostas 429
+        self.deduplicadas = 0
+        self.esperas = deque(maxlen=REST_AMOSTRAS)  # segundos entre submeter e começar
+        self.duracao = 0.0
+
+    def percentil(self, p: float) -> float:
+        if not self.esperas:
+            return 0.0
+        ordenadas = sorted(self.esperas)
+        return ordenadas[int(p * (len(ordenadas) - 1))]
+
+class AcaoREST:
+    __slots__ = ("prioridade", "seq", "fabrica", "rota", "bucket", "chave", "futuro", "criada", "tentativas", "retendo")
+
+    def __lt__(self, outra):
+        return (self.prioridade, self.seq) < (outra.prioridade, outra.seq)
+
+def _retry_after(erro: Exception):
+    if isinstance(erro, discord.RateLimited):
+        return erro.retry_after
+    if isinstance(erro, discord.HTTPException) and erro.status == 429:
         try:
-            await canal.set_permissions(member, send_messages=False)
-            canais_afetados += 1
+            return float(erro.response.headers.get("Retry-After", 1.0))
         except Exception:
+            return 1.0
+    return None
+
+rota_atual = contextvars.ContextVar("rota_atual", default=None)  # rota da ação REST rodando nesta task
+
+class Contador429(logging.Handler):
+    # discord.py repete os 429 dentro do cliente HTTP e só avisa no log; é daqui que sai a contagem
+    def __init__(self):
+        super().__init__(logging.WARNING)
+
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str) and record.msg.startswith("We are being rate limited") and "Retrying" in record.msg:
+            agendador_rest.rotas[rota_atual.get() or "fora_do_agendador"].limitadas += 1
+
+logging.getLogger("discord.http").addHandler(Contador429())
+
+def _consumir_erro(futuro: asyncio.Future):
+    # quem submeteu pode ter sido cancelado; o erro não deve virar aviso de "never retrieved"
+    if not futuro.cancelled():
+        futuro.exception()
+
+class AgendadorREST:
+    """Fila única das chamadas REST de moderação.
+
+    Sai primeiro a menor prioridade (punição antes de log). Ações pendentes com a
+    mesma `chave` compartilham um único resultado. Ações do mesmo `bucket` rodam
+    uma de cada vez. Um 429 estaciona a ação até o retry_after sem ocupar worker;
+    o bucket dela continua retido, então ninguém do mesmo bucket fura o limite.
+    Sem bucket, o 429 segura a rota inteira pelo mesmo tempo.
+    """
+
+    def __init__(self, workers: int = REST_WORKERS):
+        self.workers = workers
+        self.heap = []
+        self.pendentes = {}  # chave -> AcaoREST ainda não concluída
+        self.ocupados = set()  # buckets com chamada em curso
+        self.bloqueadas = defaultdict(list)  # bucket -> ações esperando o bucket liberar
+        self.adiadas = []  # heap de (não antes de, seq, ação) estacionadas por 429
+        self.rotas_suspensas = {}  # rota -> não antes de, para ações sem bucket
+        self.rotas = defaultdict(RotaREST)
+        self.em_curso = 0
+        self._seq = itertools.count()
+        self._tasks = []
+        self._evento = None
+
+    def submeter(self, fabrica, *, rota: str, prioridade: int = REST_MUTE, bucket=None, chave=None) -> asyncio.Future:
+        # `fabrica()` cria a corrotina da chamada; é chamada de novo a cada retry
+        acoes_por_regra.inc(regra_atual.get(), rota)
+        if chave is not None:
+            existente = self.pendentes.get(chave)
+            if existente is not None:
+                self.rotas[rota].deduplicadas += 1
+                return existente.futuro
+        loop = asyncio.get_running_loop()
+        acao = AcaoREST()
+        acao.prioridade = prioridade
+        acao.seq = next(self._seq)
+        acao.fabrica = fabrica
+        acao.rota = rota
+        acao.bucket = bucket
+        acao.chave = chave
+        acao.futuro = loop.create_future()
+        acao.futuro.add_done_callback(_consumir_erro)
+        acao.criada = time.perf_counter()
+        acao.tentativas = 0
+        acao.retendo = False  # já dona do bucket (voltando de um 429)
+        if chave is not None:
+            self.pendentes[chave] = acao
+        heapq.heappush(self.heap, acao)
+        self._iniciar(loop)
+        self._evento.set()
+        return acao.futuro
+
+    async def executar(self, fabrica, **kwargs):
+        # shield: cancelar um dos interessados não cancela a ação dos outros
+        return await asyncio.shield(self.submeter(fabrica, **kwargs))
+
+    def profundidade(self) -> list:
+        # ações na fila por classe de prioridade (inclui as presas atrás de um bucket)
+        contagem = [0] * len(REST_PRIORIDADES)
+        for acao in itertools.chain(self.heap, (a for _, _, a in self.adiadas), *self.bloqueadas.values()):
+            contagem[acao.prioridade] += 1
+        return contagem
+
+    def _iniciar(self, loop):
+        if self._evento is None:
+            self._evento = asyncio.Event()
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    def _proxima(self):
+        agora = time.monotonic()
+        while self.adiadas and self.adiadas[0][0] <= agora:
+            heapq.heappush(self.heap, heapq.heappop(self.adiadas)[2])
+        while self.heap:
+            acao = heapq.heappop(self.heap)
+            if acao.bucket is not None and not acao.retendo and acao.bucket in self.ocupados:
+                self.bloqueadas[acao.bucket].append(acao)
+                continue
+            if acao.bucket is None and acao.rota in self.rotas_suspensas:
+                ate = self.rotas_suspensas[acao.rota]
+                if ate > agora:
+                    heapq.heappush(self.adiadas, (ate, acao.seq, acao))
+                    continue
+                del self.rotas_suspensas[acao.rota]
+            return acao
+        return None
+
+    async def _worker(self):
+        while True:
+            acao = self._proxima()
+            if acao is None:
+                self._evento.clear()
+                espera = self.adiadas[0][0] - time.monotonic() if self.adiadas else None
+                try:
+                    await asyncio.wait_for(self._evento.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if acao.bucket is not None:
+                self.ocupados.add(acao.bucket)
+            self.em_curso += 1
+            adiada = False
+            try:
+                adiada = await self._rodar(acao)
+            finally:
+                self.em_curso -= 1
+                if adiada:
+                    acao.retendo = True
+                else:
+                    if acao.chave is not None and self.pendentes.get(acao.chave) is acao:
+                        del self.pendentes[acao.chave]
+                    if acao.bucket is not None:
+                        self.ocupados.discard(acao.bucket)
+                        for presa in self.bloqueadas.pop(acao.bucket, ()):
+                            heapq.heappush(self.heap, presa)
+                        self._evento.set()
+
+    async def _rodar(self, acao: AcaoREST) -> bool:
+        # devolve True quando a ação foi estacionada por um 429 e ainda vai rodar de novo
+        stats = self.rotas[acao.rota]
+        inicio = time.perf_counter()
+        if acao.tentativas == 0:
+            stats.esperas.append(inicio - acao.criada)
+            espera_rest.observar(inicio - acao.criada, acao.rota)
+        stats.chamadas += 1
+        acao.tentativas += 1
+        erro, valor = None, None
+        token = rota_atual.set(acao.rota)
+        try:
+            valor = await acao.fabrica()
+        except Exception as e:
+            erro = e
+        finally:
+            rota_atual.reset(token)
+            stats.duracao += time.perf_counter() - inicio
+        if erro is not None:
+            espera = _retry_after(erro)
+            if espera is not None:
+                stats.limitadas += 1
+                if acao.tentativas < REST_MAX_TENTATIVAS and not acao.futuro.done():
+                    # o worker fica livre para a próxima ação; o bucket segue retido por esta
+                    ate = time.monotonic() + espera
+                    if acao.bucket is None:
+                        self.rotas_suspensas[acao.rota] = max(ate, self.rotas_suspensas.get(acao.rota, 0.0))
+                    heapq.heappush(self.adiadas, (ate, acao.seq, acao))
+                    return True
+        if acao.futuro.done():
+            return False
+        if erro is None:
+            acao.futuro.set_result(valor)
+        else:
+            stats.falhas += 1
+            acao.futuro.set_exception(erro)
+        return False
+
+    def resumo(self, limite: int = 8) -> str:
+        fila = " · ".join(f"{nome}: {n}" for nome, n in zip(REST_PRIORIDADES, self.profundidade()))
+        linhas = [f"📥 fila: {fila} · em curso: {self.em_curso}"]
+        rotas = sorted(self.rotas.items(), key=lambda kv: kv[1].chamadas, reverse=True)[:limite]
+        for nome, r in rotas:
+            linhas.append(
+                f"`{nome}`: {r.chamadas} chamadas, {r.falhas} falhas, {r.limitadas}×429, "
+                f"{r.deduplicadas} dedup, espera p50 {r.percentil(0.5) * 1000:.0f}ms / p95 {r.percentil(0.95) * 1000:.0f}ms"
+            )
+        return "\n".join(linhas)
+
+agendador_rest = AgendadorREST()
+
+async def apagar_mensagem(message: discord.Message):
+    await agendador_rest.executar(
+        message.delete,
+        rota="apagar_mensagens",
+        prioridade=REST_PUNICAO,
+        bucket=message.channel.id,
+        chave=("apagar", message.id)
+    )
+
+# 🆕 FAN-OUT CONCORRENTE (edições em massa sem esperar canal por canal)
+FANOUT_WORKERS = 8
+
+class ResultadoFanOut:
+    __slots__ = ("total", "ok", "falhas", "duracao")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.ok = 0
+        self.falhas = []  # (alvo, erro)
+        self.duracao = 0.0
+
+    def __repr__(self):
+        return f"<ResultadoFanOut ok={self.ok}/{self.total} falhas={len(self.falhas)} {self.duracao:.2f}s>"
+
+# um lock por trabalho (cargo mutado, busca de convites): quem chega depois espera o primeiro terminar
+_locks_por_chave = {}
+
+def _lock_por_chave(chave) -> asyncio.Lock:
+    lock = _locks_por_chave.get(chave)
+    if lock is None:
+        lock = _locks_por_chave[chave] = asyncio.Lock()
+    return lock
+
+async def fan_out(alvos, acao, *, rota: str = None, prioridade: int = REST_MUTE, bucket=None, chave=None,
+                  limite: int = FANOUT_WORKERS) -> ResultadoFanOut:
+    """Executa acao(alvo) para cada alvo com no máximo `limite` em andamento.
+
+    Com `rota`, acao(alvo) é uma única chamada REST e vai pelo agendador_rest:
+    `bucket(alvo)` e `chave(alvo)` viram o bucket e a chave de dedup da ação, e o
+    retry de 429 fica com o agendador. Sem `rota`, acao é um passo composto que
+    submete as próprias chamadas.
+    """
+    alvos = list(alvos)
+    resultado = ResultadoFanOut(len(alvos))
+    if not alvos:
+        return resultado
+
+    inicio = time.perf_counter()
+    fila = deque(alvos)
+
+    async def rodar(alvo):
+        if rota is None:
+            await acao(alvo)
+            return
+        await agendador_rest.executar(
+            lambda: acao(alvo),
+            rota=rota,
+            prioridade=prioridade,
+            bucket=bucket(alvo) if bucket else None,
+            chave=chave(alvo) if chave else None
+        )
+
+    async def worker():
+        while fila:
+            alvo = fila.popleft()
+            try:
+                await rodar(alvo)
+                resultado.ok += 1
+            except Exception as e:
+                resultado.falhas.append((alvo, e))
+
+    await asyncio.gather(*(worker() for _ in range(min(limite, len(alvos)))))
+    resultado.duracao = time.perf_counter() - inicio
+    return resultado
+
+def _bucket_canal(canal) -> int:
+    return canal.id
+
+BULK_BAN_MAX = 200
+
+async def banir_em_lote(guild: discord.Guild, alvos, motivo: str, delete_message_seconds: int = 0) -> set:
+    # guild.bulk_ban aceita até 200 por chamada; devolve os ids efetivamente banidos
+    alvos = list(alvos)
+    banidos = set()
+    if len(alvos) == 1:
+        resultado = await fan_out(
+            alvos,
+            lambda m: guild.ban(m, reason=motivo, delete_message_seconds=delete_message_seconds),
+            rota="ban",
+            prioridade=REST_PUNICAO,
+            chave=lambda m: ("ban", guild.id, m.id)
+        )
+        return {alvos[0].id} if resultado.ok else banidos
+
+    async def banir(lote):
+        r = await guild.bulk_ban(lote, reason=motivo, delete_message_seconds=delete_message_seconds)
+        banidos.update(u.id for u in r.banned)
+
+    lotes = [alvos[i:i + BULK_BAN_MAX] for i in range(0, len(alvos), BULK_BAN_MAX)]
+    await fan_out(lotes, banir, rota="bulk_ban", prioridade=REST_PUNICAO, limite=1)
+    return banidos
+
+# 🆕 MEMBROS SOB DEMANDA (sem chunk no startup; busca só quando alguém precisa)
+MEMBROS_POR_CONSULTA = 100  # máximo de user_ids por query_members
+
+async def listar_membros(guild: discord.Guild) -> list:
+    # lista completa só para esta consulta; a lib junta pedidos simultâneos do mesmo servidor.
+    # no perfil padrão (cache de joined) a lib guarda os membros mesmo assim
+    if guild.chunked:
+        return list(guild.members)
+    return await guild.chunk(cache=False)
+
+async def obter_membros(guild: discord.Guild, ids) -> list:
+    # em lote: o que está em cache sai do get_member, o resto pelo gateway sem entrar no cache
+    membros, faltando = [], []
+    for mid in ids:
+        m = guild.get_member(mid)
+        if m is not None:
+            membros.append(m)
+        else:
+            faltando.append(mid)
+    if guild.chunked:
+        return membros
+    for i in range(0, len(faltando), MEMBROS_POR_CONSULTA):
+        lote = faltando[i:i + MEMBROS_POR_CONSULTA]
+        try:
+            membros.extend(await guild.query_members(user_ids=lote, limit=len(lote), cache=False))
+        except (asyncio.TimeoutError, RuntimeError):
             pass
+    return membros
+
+_buscas_membro = {}  # (guild_id, user_id) -> task; pedidos simultâneos dividem a mesma busca
+
+async def obter_membro(guild: discord.Guild, user_id: int):
+    member = guild.get_member(user_id)
+    if member is not None or guild.chunked:
+        return member
+    chave = (guild.id, user_id)
+    task = _buscas_membro.get(chave)
+    if task is None:
+        task = _buscas_membro[chave] = asyncio.create_task(_buscar_membro(guild, user_id))
+        task.add_done_callback(lambda _: _buscas_membro.pop(chave, None))
+    return await asyncio.shield(task)
+
+async def _buscar_membro(guild: discord.Guild, user_id: int):
+    # pelo gateway, sem REST, e o membro fica em cache: a próxima consulta sai do get_member
+    try:
+        membros = await guild.query_members(user_ids=[user_id], cache=True)
+        return membros[0] if membros else None
+    except (asyncio.TimeoutError, RuntimeError):
+        pass
+    try:
+        return await agendador_rest.executar(
+            lambda: guild.fetch_member(user_id),
+            rota="buscar_membro",
+            chave=("membro", guild.id, user_id)
+        )
+    except discord.HTTPException:
+        return None
+
+# 🆕 BACKENDS DE MUTE (escolhido por servidor com .mutemodo)
+MUTE_BACKEND_PADRAO = "canais"
+MUTED_ROLE_NAME = "mutado"
+TIMEOUT_MAX = timedelta(days=28)
+
+mute_backend_por_guild = estado.tabela("mute_backend", guild=_GUILD_CHAVE)  # guild_id -> "canais" | "cargo" | "timeout"
+text_mutes_backend = estado.tabela("text_mutes_backend", _CHAVE_TUPLA, guild=_GUILD_TUPLA)  # (guild_id, user_id) -> backend do mute ativo
+_cargo_mutado_id = {}  # guild_id -> role_id
+
+def backend_mute(guild: discord.Guild) -> str:
+    return mute_backend_por_guild.get(guild.id, MUTE_BACKEND_PADRAO)
+
+def _resultado_vazio() -> ResultadoFanOut:
+    return ResultadoFanOut(0)
+
+async def sincronizar_cargo_mutado(guild: discord.Guild, cargo: discord.Role, canais=None) -> ResultadoFanOut:
+    # só edita canais que ainda não negam send_messages para o cargo
+    canais = canais if canais is not None else canais_texto(guild)
+    pendentes = [c for c in canais if c.overwrites_for(cargo).send_messages is not False]
+    return await fan_out(
+        pendentes,
+        lambda canal: canal.set_permissions(cargo, send_messages=False, add_reactions=False, reason="sincronizando cargo de mute"),
+        rota="permissao_canal",
+        bucket=_bucket_canal
+    )
+
+async def obter_cargo_mutado(guild: discord.Guild):
+    cargo = guild.get_role(_cargo_mutado_id.get(guild.id, 0))
+    if cargo is not None:
+        return cargo
+    async with _lock_por_chave(("cargo_mutado", guild.id)):
+        cargo = discord.utils.get(guild.roles, name=MUTED_ROLE_NAME)
+        if cargo is None:
+            try:
+                cargo = await agendador_rest.executar(
+                    lambda: guild.create_role(name=MUTED_ROLE_NAME, permissions=discord.Permissions.none(), reason="cargo de mute de texto"),
+                    rota="criar_cargo"
+                )
+            except Exception:
+                return None
+        await sincronizar_cargo_mutado(guild, cargo)
+        _cargo_mutado_id[guild.id] = cargo.id
+    return cargo
+
+async def _aplicar_mute_canais(guild: discord.Guild, member: discord.Member, fim: datetime) -> ResultadoFanOut:
+    return await fan_out(
+        canais_texto(guild),
+        lambda canal: canal.set_permissions(member, send_messages=False),
+        rota="permissao_canal",
+        bucket=_bucket_canal
+    )
+
+async def _remover_mute_canais(guild: discord.Guild, member: discord.Member) -> ResultadoFanOut:
+    return await fan_out(
+        canais_texto(guild),
+        lambda canal: canal.set_permissions(member, send_messages=None),
+        rota="permissao_canal",
+        bucket=_bucket_canal
+    )
+
+async def _aplicar_mute_cargo(guild: discord.Guild, member: discord.Member, fim: datetime) -> ResultadoFanOut:
+    cargo = await obter_cargo_mutado(guild)
+    if cargo is None:
+        return await _aplicar_mute_canais(guild, member, fim)
+    return await fan_out([member], lambda m: m.add_roles(cargo, reason="mute de texto"), rota="cargo_mute")
+
+async def _remover_mute_cargo(guild: discord.Guild, member: discord.Member) -> ResultadoFanOut:
+    cargo = guild.get_role(_cargo_mutado_id.get(guild.id, 0)) or discord.utils.get(guild.roles, name=MUTED_ROLE_NAME)
+    if cargo is None:
+        return await _remover_mute_canais(guild, member)
+    if cargo not in member.roles:
+        return _resultado_vazio()
+    return await fan_out([member], lambda m: m.remove_roles(cargo, reason="fim do mute de texto"), rota="cargo_mute")
+
+async def _aplicar_mute_timeout(guild: discord.Guild, member: discord.Member, fim: datetime) -> ResultadoFanOut:
+    duracao = min(fim - datetime.utcnow(), TIMEOUT_MAX)
+    return await fan_out([member], lambda m: m.timeout(duracao, reason="mute de texto"), rota="timeout")
+
+async def _remover_mute_timeout(guild: discord.Guild, member: discord.Member) -> ResultadoFanOut:
+    if not member.is_timed_out():
+        return _resultado_vazio()
+    return await fan_out([member], lambda m: m.timeout(None, reason="fim do mute de texto"), rota="timeout")
+
+MUTE_BACKENDS = {
+    "canais": (_aplicar_mute_canais, _remover_mute_canais),
+    "cargo": (_aplicar_mute_cargo, _remover_mute_cargo),
+    "timeout": (_aplicar_mute_timeout, _remover_mute_timeout),
+}
+
+@medido("acao")
+async def aplicar_mute_texto(guild: discord.Guild, member: discord.Member, minutos: int, motivo: str = None, canal_log: discord.TextChannel = None) -> ResultadoFanOut:
+    fim = datetime.utcnow() + timedelta(minutes=minutos)
+    
+    backend = backend_mute(guild)
+    chave = (guild.id, member.id)
+    anterior = text_mutes_backend.get(chave)
+    if anterior and anterior != backend:
+        # mute anterior foi aplicado por outro backend; desfaz antes de trocar
+        await MUTE_BACKENDS[anterior][1](guild, member)
     
-    text_mutes[member.id] = fim
+    resultado = await MUTE_BACKENDS[backend][0](guild, member, fim)
+    
+    text_mutes[chave] = fim
+    text_mutes_backend[chave] = backend
+    agendador_mutes.agendar(guild.id, member.id, fim)
     
     if canal_log:
         tempo_formatado = format_tempo(minutos)
+        falhas = f"\n⚠️ {len(resultado.falhas)} chamadas falharam." if resultado.falhas else ""
         embed = discord.Embed(
             title="🔇 Mute de Texto Aplicado",
-            description=f"{member.mention} mutado em texto por {tempo_formatado}.\n{canais_afetados} canais afetados.\nMotivo: {motivo}",
+            description=f"{member.mention} mutado em texto por {tempo_formatado}.\nModo: {backend} ({resultado.ok} chamadas).{falhas}\nMotivo: {motivo}",
             color=discord.Color.purple(),
             timestamp=datetime.utcnow()
         )
-        try:
-            await canal_log.send(embed=embed)
-        except Exception:
-            pass
+        enviar_log(canal_log, embed)
+    
+    return resultado
 
-async def remover_mute_texto(guild: discord.Guild, member: discord.Member, canal_log: discord.TextChannel = None):
-    canais_afetados = 0
-    for canal in guild.text_channels:
-        try:
-            await canal.set_permissions(member, send_messages=None)
-            canais_afetados += 1
-        except Exception:
-            pass
+@medido("acao")
+async def remover_mute_texto(guild: discord.Guild, member: discord.Member, canal_log: discord.TextChannel = None) -> ResultadoFanOut:
+    chave = (guild.id, member.id)
+    backend = text_mutes_backend.pop(chave, None) or backend_mute(guild)
+    resultado = await MUTE_BACKENDS[backend][1](guild, member)
     
-    if member.id in text_mutes:
-        del text_mutes[member.id]
+    text_mutes.pop(chave, None)
+    agendador_mutes.cancelar(guild.id, member.id)
     
     if canal_log:
+        falhas = f"\n⚠️ {len(resultado.falhas)} chamadas falharam." if resultado.falhas else ""
         embed = discord.Embed(
             title="🔊 Mute de Texto Removido",
-            description=f"{member.mention} teve o mute de texto removido.\n{canais_afetados} canais afetados.",
+            description=f"{member.mention} teve o mute de texto removido.\nModo: {backend} ({resultado.ok} chamadas).{falhas}",
             color=discord.Color.green(),
             timestamp=datetime.utcnow()
         )
-        await canal_log.send(embed=embed)
+        enviar_log(canal_log, embed, prioridade=LOG_BAIXA)
+    
+    return resultado
 
-async def aplicar_mute_call(guild: discord.Guild, voice_channel: discord.VoiceChannel, motivo: str, canal_log: discord.TextChannel = None):
-    contador = 0
-    for member in voice_channel.members:
-        if not is_exempt(member):
-            try:
-                await member.edit(mute=True)
-                contador += 1
-            except Exception:
-                pass
+# 🆕 MUTE DE VOZ (idempotente, concorrente e lembrando quem o bot mutou)
+mute_call_por_guild = estado.tabela("mute_call", guild=_GUILD_CHAVE)  # guild_id -> [member_ids mutados pelo bot]; presença = modo ligado
+desmute_pendente = estado.tabela("desmute_voz", guild=_GUILD_CHAVE)  # guild_id -> [member_ids que saíram da call ainda mutados]
+
+def mute_call_ativo(guild: discord.Guild) -> bool:
+    return guild.id in mute_call_por_guild
+
+def _anotar_voz(tabela: TabelaPersistente, guild_id: int, ids, remover: bool = False):
+    if tabela is mute_call_por_guild:
+        # só .mutecall on cria a entrada; um mute que termina depois do .mutecall off não religa o modo
+        if guild_id not in tabela:
+            return
+        atual = set(tabela[guild_id])
+        tabela[guild_id] = sorted(atual - set(ids) if remover else atual | set(ids))
+        return
+    atual = set(tabela.get(guild_id, ()))
+    atual = atual - set(ids) if remover else atual | set(ids)
+    if atual:
+        tabela[guild_id] = sorted(atual)
+    else:
+        tabela.pop(guild_id, None)
+
+async def _anotar_mutados(guild: discord.Guild, membros: list):
+    if guild.id in mute_call_por_guild:
+        _anotar_voz(mute_call_por_guild, guild.id, [m.id for m in membros])
+        return
+    # o .mutecall off veio enquanto o mute estava em voo: desfaz já para quem está na call
+    conectados = [m for m in membros if m.voice is not None]
+    resultado = await fan_out(conectados, lambda m: _editar_mute_voz(m, False, "fim do mute em call"))
+    ausentes = {m.id for m in membros if m.voice is None} | {m.id for m, _ in resultado.falhas}
+    if ausentes:
+        _anotar_voz(desmute_pendente, guild.id, ausentes)
+
+async def _editar_mute_voz(member: discord.Member, mute: bool, motivo: str = None):
+    # a chave faz o agendador juntar edições iguais que chegam enquanto uma está na fila
+    await agendador_rest.executar(
+        lambda: member.edit(mute=mute, reason=motivo),
+        rota="voz",
+        chave=("voz", member.guild.id, member.id, mute)
+    )
+
+def membros_em_voz(guild: discord.Guild) -> list:
+    return [m for vc in guild.voice_channels for m in vc.members]
+
+@medido("acao")
+async def aplicar_mute_call(guild: discord.Guild, motivo: str, canal_log: discord.TextChannel = None) -> ResultadoFanOut:
+    if guild.id not in mute_call_por_guild:
+        mute_call_por_guild[guild.id] = []
+    # quem já está com mute de servidor fica de fora (e não é desmutado depois)
+    alvos = [m for m in membros_em_voz(guild) if not is_exempt(m) and not (m.voice and m.voice.mute)]
+    resultado = await fan_out(alvos, lambda m: _editar_mute_voz(m, True, motivo))
+    falhos = {m.id for m, _ in resultado.falhas}
+    await _anotar_mutados(guild, [m for m in alvos if m.id not in falhos])
     
-    if canal_log and contador > 0:
+    if canal_log and resultado.ok > 0:
         embed = discord.Embed(
             title="🔇 MUTE EM CALL APLICADO",
-            description=f"Mute aplicado no canal de voz {voice_channel.mention}.\n{contador} membros mutados.\nMotivo: {motivo}",
+            description=f"{resultado.ok} membros mutados em {len(guild.voice_channels)} canais de voz.\nMotivo: {motivo}",
             color=discord.Color.orange(),
             timestamp=datetime.utcnow()
         )
-        await canal_log.send(embed=embed)
-
-async def remover_mute_call(guild: discord.Guild, voice_channel: discord.VoiceChannel, canal_log: discord.TextChannel = None):
-    contador = 0
-    for member in voice_channel.members:
-        try:
-            await member.edit(mute=False)
-            contador += 1
-        except Exception:
-            pass
+        enviar_log(canal_log, embed)
+    return resultado
+
+@medido("acao")
+async def remover_mute_call(guild: discord.Guild, canal_log: discord.TextChannel = None) -> ResultadoFanOut:
+    mutados = set(mute_call_por_guild.pop(guild.id, ()))
+    # só dá para desmutar quem está conectado; o resto é desmutado quando voltar
+    conectados = {m.id: m for m in membros_em_voz(guild)}
+    alvos = [m for mid, m in conectados.items() if mid in mutados and m.voice and m.voice.mute]
+    resultado = await fan_out(alvos, lambda m: _editar_mute_voz(m, False, "fim do mute em call"))
+    ausentes = (mutados - conectados.keys()) | {m.id for m, _ in resultado.falhas}
+    if ausentes:
+        _anotar_voz(desmute_pendente, guild.id, ausentes)
     
-    if canal_log and contador > 0:
+    if canal_log and resultado.ok > 0:
         embed = discord.Embed(
             title="🔊 MUTE EM CALL REMOVIDO",
-            description=f"Mute removido no canal de voz {voice_channel.mention}.\n{contador} membros desmutados.",
+            description=f"{resultado.ok} membros desmutados.\n{len(ausentes)} fora da call serão desmutados ao voltar.",
             color=discord.Color.green(),
             timestamp=datetime.utcnow()
         )
-        await canal_log.send(embed=embed)
-
-async def bloquear_todos_canais_texto(guild: discord.Guild, motivo: str):
-    canais_bloqueados = 0
-    canais_protegidos = ["mod-logs"]
-    
-    for canal in guild.text_channels:
-        if canal.name.lower() not in canais_protegidos:
-            try:
-                await canal.set_permissions(guild.default_role, send_messages=False)
-                canais_bloqueados += 1
-            except Exception:
-                pass
-    
-    return canais_bloqueados
-
-async def desbloquear_todos_canais_texto(guild: discord.Guild):
-    canais_desbloqueados = 0
+        enviar_log(canal_log, embed, prioridade=LOG_BAIXA)
+    return resultado
+
+# 🔒 LOCKDOWN (.muteall / modo raid)
+# guild_id -> {"motivo": str, "canais": {channel_id: send_messages do @everyone antes do lockdown}}
+# a presença da guild na tabela é o próprio estado "em lockdown"; o snapshot sobrevive a restart
+lockdown_por_guild = estado.tabela("lockdown", guild=_GUILD_CHAVE)
+CANAIS_PROTEGIDOS = {LOG_CHANNEL_NAME}
+
+def em_lockdown(guild: discord.Guild) -> bool:
+    return guild.id in lockdown_por_guild
+
+async def _definir_envio(canal: discord.TextChannel, alvo, valor):
+    # mexe só em send_messages; o resto do overwrite (view_channel etc.) fica como está
+    overwrite = canal.overwrites_for(alvo)
+    overwrite.send_messages = valor
+    if overwrite.is_empty():
+        await canal.set_permissions(alvo, overwrite=None)
+    else:
+        await canal.set_permissions(alvo, overwrite=overwrite)
+
+async def bloquear_todos_canais_texto(guild: discord.Guild, motivo: str, canais=None, assumir: bool = False) -> int:
+    """Tranca os canais de texto para o @everyone guardando o estado anterior de cada um.
+
+    Idempotente: rodar de novo (retomada após restart, canal criado durante o
+    lockdown) só tranca o que ainda está aberto e nunca sobrescreve o snapshot.
+    Com assumir=True o lockdown em curso passa a ter este motivo (.muteall sobre o raid).
+    """
+    registro = lockdown_por_guild.get(guild.id) or {"motivo": motivo, "canais": {}}
+    if assumir:
+        registro["motivo"] = motivo
+    snapshot = registro["canais"]
+    papel = guild.default_role
+    alvos = []
+    for canal in canais if canais is not None else canais_texto(guild):
+        if canal.name.lower() in CANAIS_PROTEGIDOS:
+            continue
+        anterior = canal.overwrites_for(papel).send_messages
+        snapshot.setdefault(str(canal.id), anterior)
+        if anterior is not False:
+            alvos.append(canal)
+    lockdown_por_guild[guild.id] = registro
+    # snapshot no disco antes da primeira chamada; um crash no meio ainda sabe o que desfazer
+    await estado.flush()
     
-    for canal in guild.text_channels:
-        try:
-            await canal.set_permissions(guild.default_role, send_messages=None)
-            canais_desbloqueados += 1
-        except Exception:
-            pass
+    resultado = await fan_out(alvos, lambda c: _definir_envio(c, papel, False), rota="permissao_canal", bucket=_bucket_canal)
+    return resultado.ok
+
+async def desbloquear_todos_canais_texto(guild: discord.Guild) -> int:
+    """Devolve cada canal ao send_messages que o @everyone tinha antes do lockdown."""
+    registro = lockdown_por_guild.get(guild.id)
+    if registro is None:
+        return 0
+    papel = guild.default_role
+    pares = []
+    for chave, anterior in registro["canais"].items():
+        canal = guild.get_channel(int(chave))
+        if canal is None or canal.overwrites_for(papel).send_messages == anterior:
+            continue
+        pares.append((canal, anterior))
     
-    return canais_desbloqueados
+    resultado = await fan_out(
+        pares,
+        lambda par: _definir_envio(par[0], papel, par[1]),
+        rota="permissao_canal",
+        bucket=lambda par: par[0].id
+    )
+    if resultado.falhas:
+        # fica só o que falhou; o próximo .muteall off tenta de novo
+        registro["canais"] = {str(canal.id): anterior for (canal, anterior), _ in resultado.falhas}
+        lockdown_por_guild[guild.id] = registro
+    else:
+        lockdown_por_guild.pop(guild.id, None)
+    return resultado.ok
 
 async def encerrar_canal_e_cleanup(canal: discord.abc.GuildChannel):
     try:
@@ -264,16 +1609,370 @@ async def encerrar_canal_e_cleanup(canal: discord.abc.GuildChannel):
     except Exception:
         pass
     try:
-        await canal.delete()
+        await agendador_rest.executar(canal.delete, rota="apagar_canal", prioridade=REST_AVISO, chave=("apagar_canal", canal.id))
     except Exception:
         pass
 
-async def atualizar_convites_safe(guild: discord.Guild):
-    try:
+# 🆕 RASTREADOR DE CONVITES (cache incremental; uma busca compartilhada por rajada de entradas)
+CONVITES_DEBOUNCE = 1.0
+VANITY = "vanity"
+
+ORIGEM_CONVITE = "convite"
+ORIGEM_VANITY = "vanity"
+ORIGEM_DESCONHECIDA = "desconhecida"
+
+class RastreadorConvites:
+    def __init__(self):
+        self.criadores = {}  # guild_id -> {code: inviter_id}
+        self.removidos = {}  # guild_id -> {code: uses} apagados desde a última busca
+        self.pendentes = {}  # guild_id -> [(member, future)] aguardando a próxima busca
+        self._tasks = set()
+        self.buscas = 0
+        self.entradas = 0
+
+    async def snapshot(self, guild: discord.Guild) -> dict:
         convites = await guild.invites()
-        invite_cache[guild.id] = {i.code: i.uses for i in convites}
-    except Exception:
-        invite_cache[guild.id] = {}
+        self.buscas += 1
+        usos = {i.code: i.uses for i in convites}
+        self.criadores[guild.id] = {i.code: i.inviter.id for i in convites if i.inviter}
+        if "VANITY_URL" in guild.features:
+            try:
+                vanity = await guild.vanity_invite()
+                if vanity is not None:
+                    usos[VANITY] = vanity.uses
+            except Exception:
+                pass
+        return usos
+
+    async def atualizar(self, guild: discord.Guild):
+        async with _lock_por_chave(("convites", guild.id)):
+            try:
+                invite_cache[guild.id] = await self.snapshot(guild)
+            except Exception:
+                invite_cache[guild.id] = {}
+
+    def convite_criado(self, invite: discord.Invite):
+        if invite.guild is None:
+            return
+        guild_id = invite.guild.id
+        invite_cache.setdefault(guild_id, {})[invite.code] = invite.uses or 0
+        invite_cache.marcar(guild_id)
+        if invite.inviter:
+            self.criadores.setdefault(guild_id, {})[invite.code] = invite.inviter.id
+
+    def convite_apagado(self, invite: discord.Invite):
+        if invite.guild is None:
+            return
+        guild_id = invite.guild.id
+        cache = invite_cache.get(guild_id)
+        if cache and invite.code in cache:
+            # pode ter sido apagado por atingir max_uses com a própria entrada
+            self.removidos.setdefault(guild_id, {})[invite.code] = cache.pop(invite.code)
+            invite_cache.marcar(guild_id)
+
+    async def entrada(self, member: discord.Member):
+        # devolve (origem, código, inviter_id); entradas próximas dividem uma só busca
+        self.entradas += 1
+        guild = member.guild
+        fut = asyncio.get_running_loop().create_future()
+        fila = self.pendentes.get(guild.id)
+        if fila is None:
+            fila = self.pendentes[guild.id] = []
+            task = asyncio.create_task(self._resolver(guild))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        fila.append((member, fut))
+        return await fut
+
+    async def _resolver(self, guild: discord.Guild):
+        await asyncio.sleep(CONVITES_DEBOUNCE)
+        fila = self.pendentes.pop(guild.id, [])
+        atribuicoes = []
+        try:
+            async with _lock_por_chave(("convites", guild.id)):
+                antes = invite_cache.get(guild.id, {})
+                removidos = self.removidos.pop(guild.id, {})
+                try:
+                    depois = await self.snapshot(guild)
+                except Exception:
+                    depois = None
+                if depois is not None:
+                    atribuicoes = self._atribuir(guild.id, antes, depois, removidos, len(fila))
+                    invite_cache[guild.id] = depois
+        finally:
+            for i, (_, fut) in enumerate(fila):
+                if not fut.done():
+                    fut.set_result(atribuicoes[i] if i < len(atribuicoes) else (ORIGEM_DESCONHECIDA, None, None))
+
+    def _atribuir(self, guild_id: int, antes: dict, depois: dict, removidos: dict, n: int) -> list:
+        criadores = self.criadores.get(guild_id, {})
+        codigos = []
+        for codigo, usos in depois.items():
+            if codigo == VANITY:
+                continue
+            codigos.extend([codigo] * max(usos - antes.get(codigo, 0), 0))
+        # convites que sumiram entre as buscas só entram se faltar explicação
+        for codigo in removidos:
+            if len(codigos) >= n:
+                break
+            if codigo not in depois:
+                codigos.append(codigo)
+        codigos.extend([VANITY] * max(depois.get(VANITY, 0) - antes.get(VANITY, 0), 0))
+        # a busca não diz quem entrou por qual código; com mais de um no lote, ninguém é atribuído
+        if len(set(codigos)) > 1:
+            return []
+
+        atribuicoes = []
+        for codigo in codigos[:n]:
+            if codigo == VANITY:
+                atribuicoes.append((ORIGEM_VANITY, VANITY, None))
+            else:
+                atribuicoes.append((ORIGEM_CONVITE, codigo, criadores.get(codigo)))
+        return atribuicoes
+
+rastreador_convites = RastreadorConvites()
+
+# 🆕 LIVRO DE CONVITES (quem convidou quem, com índice reverso e contadores por convidador)
+CONTA_FALSA_DIAS = 7
+
+class LivroConvites:
+    def __init__(self):
+        # (guild_id, member_id) -> {"por": inviter_id, "codigo": str, "ativo": bool, "falso": bool}
+        self.convite_de = estado.tabela("convite_de", _CHAVE_TUPLA, guild=_GUILD_TUPLA)
+        # (guild_id, inviter_id) -> {"ativos", "saidas", "falsos", "reentradas"}; falsos = contas novas ainda no servidor
+        self.contagem = estado.tabela("convites_contagem", _CHAVE_TUPLA, guild=_GUILD_TUPLA)
+
+    def _contador(self, guild_id: int, inviter_id: int) -> dict:
+        chave = (guild_id, inviter_id)
+        c = self.contagem.get(chave)
+        if c is None:
+            c = self.contagem[chave] = {"ativos": 0, "saidas": 0, "falsos": 0, "reentradas": 0}
+        return c
+
+    def _somar(self, guild_id: int, inviter_id: int, campo: str, delta: int):
+        if inviter_id is None:
+            return
+        self._contador(guild_id, inviter_id)[campo] += delta
+        self.contagem.marcar((guild_id, inviter_id))
+
+    def registrar_entrada(self, member: discord.Member, inviter_id: int = None, codigo: str = None):
+        guild_id = member.guild.id
+        chave = (guild_id, member.id)
+        anterior = self.convite_de.get(chave)
+        if anterior is not None and anterior["ativo"]:
+            # entrada duplicada (evento repetido); nada muda
+            return
+        falso = (discord.utils.utcnow() - member.created_at) < timedelta(days=CONTA_FALSA_DIAS)
+        if anterior is not None:
+            # reentrada: a saída contada para quem convidou antes deixa de valer
+            self._somar(guild_id, anterior["por"], "saidas", -1)
+            self._somar(guild_id, inviter_id, "reentradas", 1)
+        self._somar(guild_id, inviter_id, "ativos", 1)
+        if falso:
+            self._somar(guild_id, inviter_id, "falsos", 1)
+        self.convite_de[chave] = {"por": inviter_id, "codigo": codigo, "ativo": True, "falso": falso}
+
+    def registrar_saida(self, guild_id: int, member_id: int):
+        chave = (guild_id, member_id)
+        registro = self.convite_de.get(chave)
+        if registro is None or not registro["ativo"]:
+            return
+        registro["ativo"] = False
+        self.convite_de.marcar(chave)
+        self._somar(guild_id, registro["por"], "ativos", -1)
+        self._somar(guild_id, registro["por"], "saidas", 1)
+        if registro["falso"]:
+            self._somar(guild_id, registro["por"], "falsos", -1)
+
+    def convidado_por(self, guild_id: int, member_id: int):
+        registro = self.convite_de.get((guild_id, member_id))
+        return registro["por"] if registro else None
+
+    def contagem_de(self, guild_id: int, inviter_id: int) -> dict:
+        return dict(self.contagem.get((guild_id, inviter_id)) or {"ativos": 0, "saidas": 0, "falsos": 0, "reentradas": 0})
+
+    def top(self, guild_id: int, n: int = 10) -> list:
+        return heapq.nlargest(
+            n,
+            ((inviter_id, c) for (g, inviter_id), c in self.contagem.items() if g == guild_id and c["ativos"] > 0),
+            key=lambda item: (item[1]["ativos"] - item[1]["falsos"], item[1]["ativos"])
+        )
+
+livro_convites = LivroConvites()
+
+# 🆕 MODO RAID (taxa de entradas + idade da conta + convite usado; punição em lote)
+RAID_JANELA = 30.0
+RAID_ENTRADAS = 15  # entradas na janela para disparar
+RAID_CONTAS_NOVAS = 8  # ou contas novas na janela para disparar
+RAID_CONTA_NOVA_DIAS = 3
+RAID_CODIGO_MINIMO = 5  # convite usado por tantas entradas da janela marca quem usou
+RAID_DURACAO = 10 * 60  # sem novas entradas suspeitas por esse tempo, o modo raid acaba
+RAID_LOTE_INTERVALO = 5.0
+RAID_QUARENTENA = timedelta(hours=1)
+RAID_ACOES = ("ban", "kick", "nenhuma")
+
+raid_acao_por_guild = estado.tabela("raid_acao", guild=_GUILD_CHAVE)  # guild_id -> "ban" | "kick" | "nenhuma"
+
+class DetectorRaid:
+    def __init__(self):
+        self.entradas = {}  # guild_id -> deque((timestamp, member_id, conta_nova))
+        self.novas = {}  # guild_id -> contas novas dentro da janela
+        self.codigos = {}  # guild_id -> deque((timestamp, código, member_id))
+        self.contagem_codigos = {}  # guild_id -> {código: entradas na janela}
+        self.ativos = {}  # guild_id -> timestamp em que o modo raid termina
+        self.bloqueou = set()  # guilds em que o modo raid trancou os canais
+        self.quarentena = defaultdict(set)  # guild_id -> member_ids em timeout de quarentena
+        self.suspeitos = defaultdict(set)  # guild_id -> member_ids aguardando o lote
+        self.punidos = defaultdict(int)
+        self._tasks = {}  # (tipo, guild_id) -> task
+
+    def _expirar(self, guild_id: int, now: float):
+        dq = self.entradas.get(guild_id)
+        while dq and now - dq[0][0] > RAID_JANELA:
+            _, _, conta_nova = dq.popleft()
+            if conta_nova:
+                self.novas[guild_id] -= 1
+        dq = self.codigos.get(guild_id)
+        contagem = self.contagem_codigos.get(guild_id)
+        while dq and now - dq[0][0] > RAID_JANELA:
+            _, codigo, _ = dq.popleft()
+            contagem[codigo] -= 1
+            if not contagem[codigo]:
+                del contagem[codigo]
+
+    def ativo(self, guild_id: int) -> bool:
+        return guild_id in self.ativos
+
+    def registrar_entrada(self, member: discord.Member) -> bool:
+        # devolve True quando esta entrada dispara o modo raid
+        guild_id, now = member.guild.id, time.time()
+        conta_nova = (discord.utils.utcnow() - member.created_at) < timedelta(days=RAID_CONTA_NOVA_DIAS)
+        self._expirar(guild_id, now)
+        self.entradas.setdefault(guild_id, deque()).append((now, member.id, conta_nova))
+        self.novas[guild_id] = self.novas.get(guild_id, 0) + conta_nova
+        if guild_id in self.ativos:
+            if conta_nova:
+                self.ativos[guild_id] = now + RAID_DURACAO
+                self.suspeitos[guild_id].add(member.id)
+            return False
+        if len(self.entradas[guild_id]) >= RAID_ENTRADAS or self.novas[guild_id] >= RAID_CONTAS_NOVAS:
+            self.ativos[guild_id] = now + RAID_DURACAO
+            # quem entrou na janela com conta nova já é suspeito
+            self.suspeitos[guild_id].update(mid for _, mid, nova in self.entradas[guild_id] if nova)
+            return True
+        return False
+
+    def registrar_codigo(self, guild_id: int, member_id: int, codigo: str):
+        if not codigo:
+            return
+        now = time.time()
+        self._expirar(guild_id, now)
+        dq = self.codigos.setdefault(guild_id, deque())
+        dq.append((now, codigo, member_id))
+        contagem = self.contagem_codigos.setdefault(guild_id, {})
+        contagem[codigo] = contagem.get(codigo, 0) + 1
+        if guild_id in self.ativos and contagem[codigo] >= RAID_CODIGO_MINIMO:
+            # todo mundo que entrou pelo mesmo convite dentro da janela
+            self.suspeitos[guild_id].update(mid for _, c, mid in dq if c == codigo)
+
+    def agendar(self, tipo: str, guild_id: int, coro):
+        chave = (tipo, guild_id)
+        task = self._tasks.get(chave)
+        if task is not None and not task.done():
+            coro.close()
+            return
+        self._tasks[chave] = asyncio.create_task(coro)
+
+detector_raid = DetectorRaid()
+
+async def iniciar_modo_raid(guild: discord.Guild):
+    if not em_lockdown(guild):
+        canais = await bloquear_todos_canais_texto(guild, "modo raid")
+        detector_raid.bloqueou.add(guild.id)
+    else:
+        canais = 0
+    entradas = len(detector_raid.entradas.get(guild.id, ()))
+    embed = discord.Embed(
+        title="🚨 MODO RAID ATIVADO",
+        description=f"{entradas} entradas em {RAID_JANELA:.0f}s ({detector_raid.novas.get(guild.id, 0)} contas novas).\n{canais} canais trancados. Novas entradas ficam em quarentena.",
+        color=discord.Color.dark_red(),
+        timestamp=datetime.utcnow()
+    )
+    enviar_log(canal_log_de(guild), embed, prioridade=LOG_ALTA)
+    detector_raid.agendar("fim", guild.id, _encerrar_modo_raid_quando_calmo(guild))
+
+async def _encerrar_modo_raid_quando_calmo(guild: discord.Guild):
+    while True:
+        fim = detector_raid.ativos.get(guild.id)
+        if fim is None:
+            return
+        espera = fim - time.time()
+        if espera <= 0:
+            break
+        await asyncio.sleep(espera)
+    await encerrar_modo_raid(guild)
+
+async def encerrar_modo_raid(guild: discord.Guild):
+    if detector_raid.ativos.pop(guild.id, None) is None:
+        return
+    # o último lote sai antes de liberar a quarentena
+    await _punir_suspeitos(guild)
+    canais = 0
+    if guild.id in detector_raid.bloqueou:
+        detector_raid.bloqueou.discard(guild.id)
+        canais = await desbloquear_todos_canais_texto(guild)
+    quarentena = await obter_membros(guild, detector_raid.quarentena.pop(guild.id, ()))
+    await fan_out(quarentena, lambda m: m.timeout(None, reason="fim do modo raid"), rota="timeout")
+    embed = discord.Embed(
+        title="✅ MODO RAID ENCERRADO",
+        description=f"{canais} canais destrancados. {len(quarentena)} membros saíram da quarentena.",
+        color=discord.Color.green(),
+        timestamp=datetime.utcnow()
+    )
+    enviar_log(canal_log_de(guild), embed, prioridade=LOG_ALTA)
+
+async def quarentenar(member: discord.Member):
+    detector_raid.quarentena[member.guild.id].add(member.id)
+    await fan_out([member], lambda m: m.timeout(RAID_QUARENTENA, reason="quarentena: modo raid"), rota="timeout")
+
+async def _lote_raid(guild: discord.Guild):
+    while detector_raid.ativo(guild.id) or detector_raid.suspeitos.get(guild.id):
+        await asyncio.sleep(RAID_LOTE_INTERVALO)
+        await _punir_suspeitos(guild)
+
+async def _punir_suspeitos(guild: discord.Guild):
+    ids = detector_raid.suspeitos.pop(guild.id, set())
+    acao = raid_acao_por_guild.get(guild.id, "ban")
+    if not ids or acao == "nenhuma":
+        return
+    alvos = [m for m in await obter_membros(guild, ids) if not m.bot and not is_exempt(m)]
+    if not alvos:
+        return
+    motivo = "modo raid: entrada suspeita"
+    if acao == "ban":
+        punidos = len(await banir_em_lote(guild, alvos, motivo, delete_message_seconds=3600))
+    else:
+        resultado = await fan_out(
+            alvos,
+            lambda m: m.kick(reason=motivo),
+            rota="kick",
+            prioridade=REST_PUNICAO,
+            chave=lambda m: ("kick", m.guild.id, m.id)
+        )
+        punidos = resultado.ok
+    detector_raid.punidos[guild.id] += punidos
+    for m in alvos:
+        detector_raid.quarentena[guild.id].discard(m.id)
+    embed = discord.Embed(
+        title="🔨 Lote do modo raid",
+        description=f"{punidos}/{len(alvos)} contas suspeitas ({acao}).",
+        color=discord.Color.red(),
+        timestamp=datetime.utcnow()
+    )
+    enviar_log(canal_log_de(guild), embed, prioridade=LOG_ALTA)
+
+async def atualizar_convites_safe(guild: discord.Guild):
+    await rastreador_convites.atualizar(guild)
 
 class MusicView(discord.ui.View):
     def __init__(self, user_id: int):
@@ -306,7 +2005,7 @@ class MusicView(discord.ui.View):
 
 def gerar_nome_pecadores(guild: discord.Guild):
     base = CHANNEL_BASE
-    existing = {c.name for c in guild.text_channels}
+    existing = diretorio_canais(guild).por_nome
     if base not in existing:
         return base
     
@@ -329,369 +2028,679 @@ async def _safety_close_if_no_interaction(canal: discord.TextChannel, timeout: i
 async def _auto_close_channel_after(canal: discord.TextChannel, segundos: int):
     pass
 
+# 🆕 AQUECIMENTO (startup em fases medidas; a moderação liga antes dos caches lentos)
+AQUECIMENTO_WORKERS = 4  # servidores buscando convites ao mesmo tempo
+
+prontidao = []  # (fase, segundos, detalhe) do último on_ready
+_lockdowns_retomados = False
+
+def _fase(nome: str, inicio: float, detalhe: str = ""):
+    prontidao.append((nome, time.perf_counter() - inicio, detalhe))
+
+def resumo_prontidao() -> str:
+    return " · ".join(f"{nome} {seg * 1000:.0f}ms" + (f" ({detalhe})" if detalhe else "") for nome, seg, detalhe in prontidao)
+
 @bot.event
+@medido("evento")
 async def on_ready():
     print(f"✅ {bot.user} online!")
     print(f"📝 Prefixo: .")
-    print(f"🔧 Comandos disponíveis: .menu_admin, .clear, .ban, .mute, .link, .falar, .mutecall, .muteall")
-
+    print(f"🔧 Comandos disponíveis: .menu_admin, .clear, .ban, .mute, .link, .falar, .mutecall, .muteall, .mutemodo, .regras, .stats, .memoria, .rest, .travamentos, .convites, .topconvites, .raid, .massa")
+    if AUTO_SHARD:
+        print(f"🧩 shards {sorted(bot.shards)} de {bot.shard_count} · {len(bot.guilds)} servidores neste processo")
+    prontidao.clear()
+
+    # 1. expiração de mutes e tarefas de fundo primeiro: nada disso depende de cache
+    inicio = time.perf_counter()
+    agendar_mutes_persistidos()
+    agendador_mutes.iniciar()
+    watchdog_loop.iniciar()
+    if not gravar_estado.is_running():
+        gravar_estado.start()
+    if not varrer_usuarios.is_running():
+        varrer_usuarios.start()
+    await iniciar_metricas()
+    _fase("agendador", inicio, f"{len(agendador_mutes)} mutes")
+
+    inicio = time.perf_counter()
     for guild in bot.guilds:
-        await atualizar_convites_safe(guild)
-    if not verificar_text_mutes.is_running():
-        verificar_text_mutes.start()
-    print("🔁 loop de mutes de texto iniciado.")
+        indexar_cargos(guild)
+    _fase("cargos", inicio, f"{len(bot.guilds)} servidores")
+
+    inicio = time.perf_counter()
+    retomados = 0
+    # on_ready também volta depois de cada reconexão do gateway; só o primeiro é um restart
+    global _lockdowns_retomados
+    for guild_id, registro in list(lockdown_por_guild.items()) if not _lockdowns_retomados else ():
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            continue
+        retomados += 1
+        if registro["motivo"] == "modo raid" and not detector_raid.ativo(guild.id):
+            # o detector de raid não sobrevive a restart; ninguém mais destrancaria
+            asyncio.create_task(desbloquear_todos_canais_texto(guild))
+        else:
+            # lockdown interrompido por restart: termina de trancar o que faltou
+            asyncio.create_task(bloquear_todos_canais_texto(guild, registro["motivo"]))
+    _lockdowns_retomados = True
+    _fase("lockdown", inicio, f"{retomados} retomados")
+
+    # 2. convites de todos os servidores em paralelo, com teto
+    inicio = time.perf_counter()
+    resultado = await fan_out(bot.guilds, atualizar_convites_safe, limite=AQUECIMENTO_WORKERS)
+    _fase("convites", inicio, f"{resultado.ok}/{resultado.total} servidores")
+
+    print(f"⏱️ pronto: {resumo_prontidao()}")
 
 @bot.event
+@medido("evento")
+async def on_shard_ready(shard_id: int):
+    servidores = sum(1 for g in bot.guilds if g.shard_id == shard_id)
+    print(f"🧩 shard {shard_id} pronto ({servidores} servidores).")
+
+@bot.event
+@medido("evento")
 async def on_member_join(member: discord.Member):
     guild = member.guild
-    antes = invite_cache.get(guild.id, {})
-    depois = {}
-    convites = []
-    try:
-        convites = await guild.invites()
-        depois = {i.code: i.uses for i in convites}
-    except Exception:
-        pass
-    usado = None
-    for codigo, usos in depois.items():
-        if codigo in antes and usos > antes[codigo]:
-            usado = codigo
-            break
-    if usado:
-        criador = None
-        for i in convites:
-            if i.code == usado:
-                criador = i.inviter
-                break
-        if criador:
-            if criador.id not in convites_por_usuario:
-                convites_por_usuario[criador.id] = []
-            convites_por_usuario[criador.id].append(member.id)
-    invite_cache[guild.id] = depois
+    fim = text_mutes.get((guild.id, member.id))
+    if fim is not None:
+        agendador_mutes.agendar(guild.id, member.id, fim)
+    
+    if not member.bot:
+        if detector_raid.registrar_entrada(member):
+            detector_raid.agendar("inicio", guild.id, iniciar_modo_raid(guild))
+        if detector_raid.ativo(guild.id):
+            await quarentenar(member)
+            detector_raid.agendar("lote", guild.id, _lote_raid(guild))
+    
+    origem, codigo, criador_id = await rastreador_convites.entrada(member)
+    livro_convites.registrar_entrada(member, criador_id, codigo)
+    detector_raid.registrar_codigo(guild.id, member.id, codigo)
 
 @bot.event
-async def on_member_remove(member: discord.Member):
-    for criador_id, lista in list(convites_por_usuario.items()):
-        if member.id in lista:
-            lista.remove(member.id)
-            if not lista:
-                del convites_por_usuario[criador_id]
-            break
-
-@tasks.loop(seconds=30)
-async def verificar_text_mutes():
-    agora = datetime.utcnow()
-    expirados = [user_id for user_id, fim in list(text_mutes.items()) if agora >= fim]
-    
-    for user_id in expirados:
-        for guild in bot.guilds:
-            member = guild.get_member(user_id)
-            if member:
-                canal_log = discord.utils.get(guild.text_channels, name="mod-logs")
-                await remover_mute_texto(guild, member, canal_log)
-                try:
-                    del text_mutes[user_id]
-                except KeyError:
-                    pass
+@medido("evento")
+async def on_invite_create(invite: discord.Invite):
+    rastreador_convites.convite_criado(invite)
 
 @bot.event
-async def on_message(message: discord.Message):
-    if message.author.bot or not message.guild:
-        await bot.process_commands(message)
-        return
+@medido("evento")
+async def on_invite_delete(invite: discord.Invite):
+    rastreador_convites.convite_apagado(invite)
 
-    member = message.author
-    if is_exempt(member):
-        await bot.process_commands(message)
-        return
+@bot.event
+@medido("evento")
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # o evento sem raw só vem para membros em cache, e os membros não são carregados no startup
+    livro_convites.registrar_saida(payload.guild_id, payload.user.id)
+
+# apagadas por mods, pelo próprio autor ou por outro bot: saem dos recentes para a limpeza não tentar de novo
+def _retirar_apagadas(message_ids):
+    for dono, ids in indice_recentes.retirar(message_ids).items():
+        rec = usuarios.registros.get(dono)
+        if rec is not None:
+            rec.retirar_recentes(ids)
 
-    now = time.time()
-    canal_log = discord.utils.get(message.guild.text_channels, name="mod-logs")
+@bot.event
+@medido("evento")
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    _retirar_apagadas((payload.message_id,))
 
-    # 🆕 VERIFICAÇÃO DE SPAM DE FIGURINHAS
-    if message.stickers:
-        # 🚨 Anti-Flood: Muitas figurinhas diferentes em pouco tempo
-        sticker_dq = user_sticker_times[member.id]
-        sticker_dq.append(now)
-        
-        # Limpa figurinhas antigas (10 segundos)
-        while sticker_dq and now - sticker_dq[0] > FLOOD_WINDOW:
-            sticker_dq.popleft()
-        
-        # Se +8 figurinhas em 10 segundos = MUTE
-        if len(sticker_dq) >= STICKER_FLOOD_LIMIT:
-            nivel = mute_level.get(member.id, 0)
-            minutos = 15 if nivel == 0 else 30 if nivel == 1 else 60
-            mute_level[member.id] = min(nivel + 1, 3)
-            motivo = f"spam de figurinhas ({len(sticker_dq)} em {FLOOD_WINDOW}s)"
-            
-            # Tenta deletar as figurinhas recentes
-            try:
-                async for msg in message.channel.history(limit=20):
-                    if msg.author.id == member.id and msg.stickers:
-                        try:
-                            await msg.delete()
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-            
-            await aplicar_mute_texto(message.guild, member, minutos, motivo, canal_log)
-            user_sticker_times.pop(member.id, None)
-            
-            embed = discord.Embed(
-                description=f"🚫 {member.mention} mutado por {minutos}min por spam de figurinhas.", 
-                color=discord.Color.red()
-            )
-            try:
-                await message.channel.send(embed=embed, delete_after=10)
-            except Exception:
-                pass
-            return
-        
-        # 🚨 Anti-Repetição: Figurinhas IGUAIS seguidas (igual mensagens)
-        current_sticker_id = message.stickers[0].id if message.stickers else None
-        
-        if current_sticker_id:
-            # Adiciona à lista de figurinhas recentes
-            user_sticker_repeats[member.id].append({
-                'sticker_id': current_sticker_id,
-                'timestamp': now,
-                'message': message
-            })
-            
-            # Remove figurinhas antigas (15 segundos)
-            user_sticker_repeats[member.id] = [
-                s for s in user_sticker_repeats[member.id] 
-                if now - s['timestamp'] <= 15.0
-            ]
-            
-            # Conta quantas vezes a MESMA figurinha apareceu nos últimos 15s
-            same_sticker_count = sum(
-                1 for s in user_sticker_repeats[member.id] 
-                if s['sticker_id'] == current_sticker_id
-            )
-            
-            # Se 5+ figurinhas IGUAIS em 15 segundos = MUTE
-            if same_sticker_count >= STICKER_REPEAT_LIMIT:
-                nivel = mute_level.get(member.id, 0)
-                minutos = 5 if nivel == 0 else 10 if nivel == 1 else 20
-                mute_level[member.id] = min(nivel + 1, 3)
-                motivo = f"repetição de figurinhas ({same_sticker_count}x a mesma em 15s)"
-                
-                # Deleta todas as figurinhas repetidas
-                for sticker_data in user_sticker_repeats[member.id]:
-                    if sticker_data['sticker_id'] == current_sticker_id:
-                        try:
-                            await sticker_data['message'].delete()
-                        except Exception:
-                            pass
-                
-                await aplicar_mute_texto(message.guild, member, minutos, motivo, canal_log)
-                
-                # Limpa os dados
-                user_sticker_repeats[member.id] = []
-                last_sticker[member.id] = None
-                
-                embed = discord.Embed(
-                    description=f"🚫 {member.mention} mutado por {minutos}min por repetir a mesma figurinha {same_sticker_count}x.", 
-                    color=discord.Color.red()
-                )
+@bot.event
+@medido("evento")
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    _retirar_apagadas(payload.message_ids)
+
+@tasks.loop(seconds=USUARIOS_VARREDURA)
+async def varrer_usuarios():
+    usuarios.varrer(time.time())
+
+@tasks.loop(seconds=ESTADO_FLUSH_INTERVALO)
+async def gravar_estado():
+    await estado.flush()
+
+# 🆕 AGENDADOR DE EXPIRAÇÃO DE MUTES (heap por prazo; dorme até o próximo vencimento)
+class AgendadorMutes:
+    def __init__(self, callback):
+        self.callback = callback
+        self.heap = []  # (fim, seq, guild_id, user_id)
+        self.prazos = {}  # (guild_id, user_id) -> seq da entrada válida
+        self._seq = 0
+        self._acordar = asyncio.Event()
+        self._task = None
+        self._pendentes = set()
+
+    def agendar(self, guild_id: int, user_id: int, fim: datetime):
+        # reaplicar um mute só troca o prazo; a entrada antiga vira lixo no heap
+        self._seq += 1
+        self.prazos[(guild_id, user_id)] = self._seq
+        heapq.heappush(self.heap, (fim, self._seq, guild_id, user_id))
+        if self.heap[0][1] == self._seq:
+            self._acordar.set()
+        if len(self.heap) > 2 * len(self.prazos) + 64:
+            self._compactar()
+
+    def cancelar(self, guild_id: int, user_id: int):
+        self.prazos.pop((guild_id, user_id), None)
+
+    def _valida(self, entrada) -> bool:
+        return self.prazos.get((entrada[2], entrada[3])) == entrada[1]
+
+    def _compactar(self):
+        self.heap = [e for e in self.heap if self._valida(e)]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.prazos)
+
+    def iniciar(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._rodar())
+
+    async def _rodar(self):
+        while True:
+            while self.heap and not self._valida(self.heap[0]):
+                heapq.heappop(self.heap)
+            espera = None
+            if self.heap:
+                espera = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+            if espera is None or espera > 0:
+                self._acordar.clear()
                 try:
-                    await message.channel.send(embed=embed, delete_after=10)
-                except Exception:
+                    await asyncio.wait_for(self._acordar.wait(), espera)
+                except asyncio.TimeoutError:
                     pass
-                return
-
-    if "discord.gg/" in message.content.lower() or "discord.com/invite/" in message.content.lower():
-        invite_regex = r'(?:discord\.gg\/|discord\.com\/invite\/)([a-zA-Z0-9]+)'
-        matches = re.findall(invite_regex, message.content)
-        is_own_server_invite = any(match == "3dpxCUAWxn" for match in matches)
-        
-        if not is_own_server_invite:
-            try:
-                await message.delete()
-            except Exception:
-                pass
-            minutos = 60
-            motivo = "Tentativa de enviar convite de outro servidor"
-            canal_log = discord.utils.get(message.guild.text_channels, name="mod-logs")
-            await aplicar_mute_texto(message.guild, member, minutos, motivo, canal_log)
-            tempo_formatado = format_tempo(minutos)
-            embed = discord.Embed(
-                description=f"🚫 {member.mention}, você foi mutado por {tempo_formatado} por enviar um convite de outro servidor.", 
-                color=discord.Color.red()
-            )
-            try:
-                await message.channel.send(embed=embed, delete_after=10)
-            except Exception:
-                pass
-            return 
-    
-    if tem_cargo_inveja(member) or tem_cargo_boost(member):
-        await bot.process_commands(message)
-        return
-
-    if member.id in text_mutes:
+                continue
+            _, _, guild_id, user_id = heapq.heappop(self.heap)
+            del self.prazos[(guild_id, user_id)]
+            task = asyncio.create_task(self._expirar(guild_id, user_id))
+            self._pendentes.add(task)
+            task.add_done_callback(self._pendentes.discard)
+
+    async def _expirar(self, guild_id: int, user_id: int):
         try:
-            await message.delete()
+            await self.callback(guild_id, user_id)
         except Exception:
             pass
+
+async def expirar_mute_texto(guild_id: int, user_id: int):
+    fim = text_mutes.get((guild_id, user_id))
+    if fim is None:
         return
+    if fim > datetime.utcnow():
+        # mute foi estendido por outro caminho; reagenda
+        agendador_mutes.agendar(guild_id, user_id, fim)
+        return
+    guild = bot.get_guild(guild_id)
+    member = await obter_membro(guild, user_id) if guild else None
+    if member is None:
+        # fica em text_mutes; on_member_join remove quando a pessoa voltar
+        return
+    canal_log = canal_log_de(guild)
+    await remover_mute_texto(guild, member, canal_log)
+
+agendador_mutes = AgendadorMutes(expirar_mute_texto)
+
+def agendar_mutes_persistidos():
+    for (guild_id, user_id), fim in list(text_mutes.items()):
+        if bot.get_guild(guild_id) is not None:
+            agendador_mutes.agendar(guild_id, user_id, fim)
+
+# 🆕 PIPELINE DE REGRAS DO on_message (conteúdo normalizado uma vez, regras em sequência)
+OWN_INVITE_CODE = "3dpxCUAWxn"
+INVITE_REGEX = re.compile(r'(?i:discord\.gg/|discord\.com/invite/)([a-zA-Z0-9]+)')
+LINK_REGEX = re.compile(r'https?://')
+ESPACOS_REGEX = re.compile(r'\s+')
+
+class VisaoMensagem:
+    __slots__ = ("message", "member", "guild", "chave", "now", "limpo", "minusculo", "normalizado", "tem_convite", "curta", "_usuario")
+
+    def __init__(self, message: discord.Message, now: float):
+        self.message = message
+        self.member = message.author
+        self.guild = message.guild
+        self.chave = (message.guild.id, message.author.id)  # estado de moderação é por servidor
+        self.now = now
+        self.limpo = message.content.strip()
+        self.minusculo = self.limpo.lower()
+        self.normalizado = ESPACOS_REGEX.sub(' ', self.minusculo)
+        self.tem_convite = "discord.gg/" in self.minusculo or "discord.com/invite/" in self.minusculo
+        self.curta = 0 < len(self.limpo) < 3
+        self._usuario = None
+
+    @property
+    def usuario(self) -> EstadoUsuario:
+        if self._usuario is None:
+            self._usuario = usuarios.obter(self.chave, self.now)
+        return self._usuario
+
+class Regra:
+    __slots__ = ("nome", "filtro", "executar", "avaliacoes", "acertos", "tempo")
+
+    def __init__(self, nome: str, filtro, executar):
+        self.nome = nome
+        self.filtro = filtro  # predicado barato; se False a regra nem roda
+        self.executar = executar  # async (VisaoMensagem) -> True para parar o pipeline
+        self.avaliacoes = 0
+        self.acertos = 0
+        self.tempo = 0.0
+
+REGRAS_MENSAGEM = []
+
+def regra(nome: str, filtro=None):
+    def registrar(func):
+        REGRAS_MENSAGEM.append(Regra(nome, filtro, func))
+        return func
+    return registrar
+
+async def executar_regras(v: VisaoMensagem) -> bool:
+    for r in REGRAS_MENSAGEM:
+        if r.filtro is not None and not r.filtro(v):
+            continue
+        inicio = time.perf_counter()
+        token = regra_atual.set(r.nome)
+        try:
+            parou = await r.executar(v)
+        finally:
+            regra_atual.reset(token)
+            r.avaliacoes += 1
+            r.tempo += time.perf_counter() - inicio
+        if parou:
+            r.acertos += 1
+            return True
+    return False
+
+BULK_DELETE_MAX = 100
+BULK_DELETE_DIAS = 14
+
+async def _historico(canal, limite: int) -> list:
+    return [m async for m in canal.history(limit=limite)]
+
+async def apagar_mensagens(guild: discord.Guild, pares, rec: EstadoUsuario = None) -> int:
+    # pares de (channel_id, message_id); agrupa por canal e usa bulk delete (até 100 por chamada)
+    por_canal = defaultdict(list)
+    for channel_id, message_id in pares:
+        por_canal[channel_id].append(message_id)
+    lotes = [
+        (channel_id, ids[i:i + BULK_DELETE_MAX])
+        for channel_id, ids in por_canal.items()
+        for i in range(0, len(ids), BULK_DELETE_MAX)
+    ]
+
+    async def apagar(lote):
+        channel_id, ids = lote
+        canal = guild.get_channel_or_thread(channel_id)
+        if canal is None:
+            raise LookupError(channel_id)
+        if len(ids) == 1:
+            await canal.get_partial_message(ids[0]).delete()
+        else:
+            await canal.delete_messages([discord.Object(id=i) for i in ids])
+
+    resultado = await fan_out(
+        lotes,
+        apagar,
+        rota="apagar_mensagens",
+        prioridade=REST_PUNICAO,
+        bucket=lambda lote: lote[0],
+        # mensagem avulsa usa a mesma chave de apagar_mensagem: a regra e o lote não apagam duas vezes
+        chave=lambda lote: ("apagar", lote[1][0]) if len(lote[1]) == 1 else None
+    )
+    falhos = {i for (_, ids), _ in resultado.falhas for i in ids}
+    apagados = [message_id for _, ids in lotes for message_id in ids if message_id not in falhos]
+    if rec is not None:
+        rec.retirar_recentes(apagados)
+    return len(apagados)
+
+async def _avisar_canal(v: VisaoMensagem, texto: str, delete_after: int = 10):
+    embed = discord.Embed(description=texto, color=discord.Color.red())
+    try:
+        await agendador_rest.executar(
+            lambda: v.message.channel.send(embed=embed, delete_after=delete_after),
+            rota="aviso",
+            prioridade=REST_AVISO,
+            bucket=v.message.channel.id
+        )
+    except Exception:
+        pass
+
+# 🆕 VERIFICAÇÃO DE SPAM DE FIGURINHAS
+@regra("figurinhas_flood", filtro=lambda v: v.message.stickers)
+async def regra_figurinhas_flood(v: VisaoMensagem) -> bool:
+    # 🚨 Anti-Flood: Muitas figurinhas diferentes em pouco tempo
+    member, now = v.member, v.now
+    rec = v.usuario
+    sticker_dq = rec.figurinhas
+    if sticker_dq is None:
+        sticker_dq = rec.figurinhas = deque()
+    sticker_dq.append(now)
+    
+    # Limpa figurinhas antigas (10 segundos)
+    while sticker_dq and now - sticker_dq[0] > FLOOD_WINDOW:
+        sticker_dq.popleft()
+    
+    # Se +8 figurinhas em 10 segundos = MUTE
+    if len(sticker_dq) < STICKER_FLOOD_LIMIT:
+        return False
+    
+    nivel = mute_level.get(v.chave, 0)
+    minutos = 15 if nivel == 0 else 30 if nivel == 1 else 60
+    mute_level[v.chave] = min(nivel + 1, 3)
+    motivo = f"spam de figurinhas ({len(sticker_dq)} em {FLOOD_WINDOW}s)"
+    
+    # Deleta as figurinhas recentes em todos os canais
+    await apagar_mensagens(v.guild, rec.recentes_na_janela(now, LIMPEZA_JANELA, MSG_FIGURINHA), rec)
+    
+    await aplicar_mute_texto(v.guild, member, minutos, motivo, canal_log_de(v.guild))
+    rec.figurinhas = None
+    
+    await _avisar_canal(v, f"🚫 {member.mention} mutado por {minutos}min por spam de figurinhas.")
+    return True
+
+@regra("figurinhas_repeticao", filtro=lambda v: v.message.stickers)
+async def regra_figurinhas_repeticao(v: VisaoMensagem) -> bool:
+    # 🚨 Anti-Repetição: Figurinhas IGUAIS seguidas (igual mensagens)
+    member, now = v.member, v.now
+    current_sticker_id = v.message.stickers[0].id
+    
+    # Conta quantas vezes a MESMA figurinha apareceu nos últimos 15s (já descartando as antigas)
+    rec = v.usuario
+    janela = rec.figurinhas_repetidas
+    if janela is None:
+        janela = rec.figurinhas_repetidas = JanelaRepeticao(STICKER_REPEAT_WINDOW)
+    same_sticker_count = janela.adicionar(now, current_sticker_id, v.message.id, v.message.channel.id)
+    
+    # Se 5+ figurinhas IGUAIS em 15 segundos = MUTE
+    if same_sticker_count < STICKER_REPEAT_LIMIT:
+        return False
+    
+    nivel = mute_level.get(v.chave, 0)
+    minutos = 5 if nivel == 0 else 10 if nivel == 1 else 20
+    mute_level[v.chave] = min(nivel + 1, 3)
+    motivo = f"repetição de figurinhas ({same_sticker_count}x a mesma em 15s)"
+    
+    # Deleta todas as figurinhas repetidas
+    await apagar_mensagens(v.guild, janela.mensagens(current_sticker_id), rec)
+    
+    await aplicar_mute_texto(v.guild, member, minutos, motivo, canal_log_de(v.guild))
+    
+    # Limpa os dados
+    rec.figurinhas_repetidas = None
+    
+    await _avisar_canal(v, f"🚫 {member.mention} mutado por {minutos}min por repetir a mesma figurinha {same_sticker_count}x.")
+    return True
 
-    is_command = message.content.startswith(".")
+@regra("convite", filtro=lambda v: v.tem_convite)
+async def regra_convite(v: VisaoMensagem) -> bool:
+    matches = INVITE_REGEX.findall(v.message.content)
+    if any(match == OWN_INVITE_CODE for match in matches):
+        return False
+    
+    try:
+        await apagar_mensagem(v.message)
+    except Exception:
+        pass
+    minutos = 60
+    motivo = "Tentativa de enviar convite de outro servidor"
+    await aplicar_mute_texto(v.guild, v.member, minutos, motivo, canal_log_de(v.guild))
+    tempo_formatado = format_tempo(minutos)
+    await _avisar_canal(v, f"🚫 {v.member.mention}, você foi mutado por {tempo_formatado} por enviar um convite de outro servidor.")
+    return True
+
+@regra("isento_cargo", filtro=lambda v: tem_cargo_inveja(v.member) or tem_cargo_boost(v.member))
+async def regra_isento_cargo(v: VisaoMensagem) -> bool:
+    await bot.process_commands(v.message)
+    return True
+
+@regra("mutado", filtro=lambda v: v.chave in text_mutes)
+async def regra_mutado(v: VisaoMensagem) -> bool:
+    try:
+        await apagar_mensagem(v.message)
+    except Exception:
+        pass
+    return True
 
-    dq = user_msg_times[member.id]
+@regra("flood_comandos")
+async def regra_flood_comandos(v: VisaoMensagem) -> bool:
+    member, message, now = v.member, v.message, v.now
+    rec = v.usuario
+    dq = rec.comandos
     
-    if is_command:
+    if message.content.startswith("."):
+        if dq is None:
+            dq = rec.comandos = deque()
         dq.append(now)
     
-    while dq and now - dq[0] > FLOOD_WINDOW:
-        dq.popleft()
+    if not dq:
+        return False
+    
+    while dq and now - dq[0] > FLOOD_WINDOW:
+        dq.popleft()
+    
+    if len(dq) <= FLOOD_LIMIT:
+        return False
+    
+    apagados = await apagar_mensagens(v.guild, rec.recentes_na_janela(now, FLOOD_WINDOW), rec)
         
-    if len(dq) > FLOOD_LIMIT: 
+    try:
+        await agendador_rest.executar(
+            lambda: v.guild.ban(member, reason=f"Spam de comandos: >{FLOOD_LIMIT} comandos em {FLOOD_WINDOW}s"),
+            rota="ban",
+            prioridade=REST_PUNICAO,
+            chave=("ban", v.guild.id, member.id)
+        )
         try:
-            deleted = await message.channel.purge(
-                limit=100, 
-                check=lambda m: m.author.id == member.id and now - m.created_at.timestamp() <= FLOOD_WINDOW
+            await agendador_rest.executar(
+                lambda: message.channel.send(f"🔨 {member.mention} banido por spam de comandos. {apagados} mensagens apagadas.", delete_after=7),
+                rota="aviso",
+                prioridade=REST_AVISO,
+                bucket=message.channel.id
             )
         except Exception:
-            deleted = []
-            
-        try:
-            await message.guild.ban(member, reason=f"Spam de comandos: >{FLOOD_LIMIT} comandos em {FLOOD_WINDOW}s")
-            try:
-                await message.channel.send(f"🔨 {member.mention} banido por spam de comandos. {len(deleted)} mensagens apagadas.", delete_after=7)
-            except Exception:
-                pass
-        except Exception:
-            if canal_log:
-                try:
-                    await canal_log.send(f"⚠️ Tentativa de ban automático por spam de comandos falhou para {member.mention}.")
-                except Exception:
-                    pass
-        finally:
-            user_msg_times.pop(member.id, None)
-        return
+            pass
+    except Exception:
+        enviar_log(
+            canal_log_de(v.guild),
+            conteudo=f"⚠️ Tentativa de ban automático por spam de comandos falhou para {member.mention}.",
+            prioridade=LOG_ALTA
+        )
+    finally:
+        rec.comandos = None
+    return True
 
+@regra("mensagens_curtas")
+async def regra_mensagens_curtas(v: VisaoMensagem) -> bool:
     # 🚨 Lógica de Anti-Mensagens Curtas (+5 mensagens com <3 caracteres em 10s = Mute)
-    dq_short = user_short_msgs[member.id]
-
-    content_clean = message.content.strip()
-    if len(content_clean) < 3 and content_clean != "":
+    member, now = v.member, v.now
+    rec = v.usuario
+    dq_short = rec.curtas
+    
+    if v.curta:
+        if dq_short is None:
+            dq_short = rec.curtas = deque()
         dq_short.append(now)
-
+    
+    if not dq_short:
+        return False
+    
     while dq_short and now - dq_short[0] > SHORT_MSG_WINDOW:
         dq_short.popleft()
+    
+    if len(dq_short) < SHORT_MSG_LIMIT:
+        return False
+    
+    nivel = mute_level.get(v.chave, 0)
+    minutos = 5 if nivel == 0 else 10 if nivel == 1 else 20
+    mute_level[v.chave] = min(nivel + 1, 3)
+    motivo = f"muitas mensagens curtas ({len(dq_short)}x) - nível {mute_level[v.chave]}"
+    
+    await apagar_mensagens(v.guild, rec.recentes_na_janela(now, LIMPEZA_JANELA, MSG_CURTA), rec)
+    
+    await aplicar_mute_texto(v.guild, member, minutos, motivo, canal_log_de(v.guild))
+    rec.curtas = None
+    
+    await _avisar_canal(v, f"🚫 {member.mention} mutado por {minutos}min por spam de mensagens curtas.")
+    return True
 
-    if len(dq_short) >= SHORT_MSG_LIMIT:
-        nivel = mute_level.get(member.id, 0)
-        minutos = 5 if nivel == 0 else 10 if nivel == 1 else 20
-        mute_level[member.id] = min(nivel + 1, 3)
-        motivo = f"muitas mensagens curtas ({len(dq_short)}x) - nível {mute_level[member.id]}"
-        
-        try:
-            async for msg in message.channel.history(limit=50):
-                if msg.author.id == member.id and len(msg.content.strip()) < 3 and msg.content.strip() != "":
-                    try:
-                        await msg.delete()
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-        
-        await aplicar_mute_texto(message.guild, member, minutos, motivo, canal_log)
-        user_short_msgs.pop(member.id, None)
-        
-        embed = discord.Embed(
-            description=f"🚫 {member.mention} mutado por {minutos}min por spam de mensagens curtas.", 
-                color=discord.Color.red()
-        )
-        try:
-            await message.channel.send(embed=embed, delete_after=10)
-        except Exception:
-            pass
-        return
-
-    if antilink_ativo and ("http://" in message.content or "https://" in message.content):
-        try:
-            await message.delete()
-        except Exception:
-            pass
-        embed = discord.Embed(description=f"🚫 {member.mention}, links não são permitidos!", color=discord.Color.red())
-        try:
-            await message.channel.send(embed=embed, delete_after=5)
-        except Exception:
-            pass
-        return
+@regra("links", filtro=lambda v: antilink_por_guild.get(v.guild.id, True))
+async def regra_links(v: VisaoMensagem) -> bool:
+    if not LINK_REGEX.search(v.message.content):
+        return False
+    try:
+        await apagar_mensagem(v.message)
+    except Exception:
+        pass
+    await _avisar_canal(v, f"🚫 {v.member.mention}, links não são permitidos!", delete_after=5)
+    return True
 
+@regra("repeticao")
+async def regra_repeticao(v: VisaoMensagem) -> bool:
     # 🚨 Lógica de Repetição (5 mensagens iguais em 15 segundos = Mute)
-    conteudo = re.sub(r'\s+', ' ', message.content.strip().lower())
-    prev = last_msg.get(member.id)
-    user_repeat_msgs[member.id].append(message)
+    member, message, now = v.member, v.message, v.now
+    rec = v.usuario
 
-    # Atualiza timestamp da última mensagem
-    last_msg_time[member.id] = now
+    if not v.normalizado:
+        # mensagem sem texto (anexo, embed) nunca conta como repetição
+        rec.repeticao = None
+        rec.ultima_msg = None
+        return False
 
-    # Remove mensagens antigas da lista de repetição (acima de 15 segundos)
-    user_repeat_msgs[member.id] = [msg for msg in user_repeat_msgs[member.id] if now - msg.created_at.timestamp() <= 15.0]
+    chave = hash(v.normalizado)
+    janela = rec.repeticao
+    if janela is None:
+        janela = rec.repeticao = JanelaRepeticao(REPEAT_WINDOW)
+    elif rec.ultima_msg != chave:
+        # Nova mensagem diferente, reinicia contagem
+        janela.limpar()
+    rec.ultima_msg = chave
 
     # Conta apenas mensagens dentro da janela de 15 segundos
-    recent_repeats = 0
-    if prev and conteudo != "":
-        if conteudo == prev:
-            # Conta quantas mensagens iguais tem nos últimos 15 segundos
-            for msg in user_repeat_msgs[member.id]:
-                msg_content = re.sub(r'\s+', ' ', msg.content.strip().lower())
-                if msg_content == conteudo:
-                    recent_repeats += 1
-        else:
-            # Nova mensagem diferente, reinicia contagem
-            recent_repeats = 1
-            last_msg[member.id] = conteudo
-            user_repeat_msgs[member.id] = [message]
-    else:
-        recent_repeats = 1
-        last_msg[member.id] = conteudo
-        user_repeat_msgs[member.id] = [message]
+    recent_repeats = janela.adicionar(now, chave, message.id, message.channel.id)
 
     # Aplica mute se tiver 5 mensagens iguais nos últimos 15 segundos
-    if recent_repeats >= 5:
-        if member.id not in mute_level:
-            minutos = 5
-            mute_level[member.id] = 1
-        else:
-            minutos = 50
-            mute_level[member.id] = 2
-        
-        motivo = f"repetição ({recent_repeats}x em 15s)"
-        
-        # Deleta todas as mensagens repetidas recentes
-        for msg_to_delete in user_repeat_msgs[member.id]:
-            try:
-                await msg_to_delete.delete()
-            except Exception:
-                pass
-        
-        await aplicar_mute_texto(message.guild, member, minutos, motivo, canal_log)
-        
-        # Limpa os dados de repetição
-        repeat_count[member.id] = 0
-        last_msg[member.id] = None
-        user_repeat_msgs[member.id] = []
-        
-        embed = discord.Embed(
-            description=f"🚫 {member.mention} mutado por {minutos}min por repetir a mesma mensagem {recent_repeats}x.", 
-            color=discord.Color.red()
-        )
-        try:
-            await message.channel.send(embed=embed, delete_after=10)
-        except Exception:
-            pass
+    if recent_repeats < REPEAT_LIMIT:
+        return False
+    
+    if v.chave not in mute_level:
+        minutos = 5
+        mute_level[v.chave] = 1
+    else:
+        minutos = 50
+        mute_level[v.chave] = 2
+    
+    motivo = f"repetição ({recent_repeats}x em {REPEAT_WINDOW:.0f}s)"
+    
+    # Deleta todas as mensagens repetidas recentes
+    await apagar_mensagens(v.guild, janela.mensagens(chave), rec)
+    
+    await aplicar_mute_texto(v.guild, member, minutos, motivo, canal_log_de(v.guild))
+    
+    # Limpa os dados de repetição
+    rec.ultima_msg = None
+    rec.repeticao = None
+    
+    await _avisar_canal(v, f"🚫 {member.mention} mutado por {minutos}min por repetir a mesma mensagem {recent_repeats}x.")
+    return True
+
+@bot.event
+@medido("evento")
+async def on_message(message: discord.Message):
+    if message.author.bot or not message.guild:
+        await bot.process_commands(message)
+        return
+
+    member = message.author
+    if is_exempt(member):
+        await bot.process_commands(message)
+        return
+
+    v = VisaoMensagem(message, time.time())
+    v.usuario.registrar_mensagem(
+        v.now, message.channel.id, message.id,
+        (MSG_FIGURINHA if message.stickers else 0) | (MSG_CURTA if v.curta else 0)
+    )
+    indice_recentes.adicionar(v.now, message.id, v.chave)
+    if await executar_regras(v):
         return
 
     await bot.process_commands(message)
 
+# 🆕 AÇÕES EM MASSA (seleção de membros por filtro, prévia e execução em lote)
+MENCAO_REGEX = re.compile(r'<@!?(\d+)>')
+CARGO_MENCAO_REGEX = re.compile(r'^<@&(\d+)>$')
+DURACAO_REGEX = re.compile(r'^(\d+)([smhd]?)$')
+MASSA_ACOES = ("ban", "kick", "mute")
+MASSA_PREVIA_VALIDADE = 120.0
+MASSA_MUTE_PADRAO = 60
+
+_UNIDADES_DURACAO = {"s": 1, "m": 60, "h": 3600, "d": 86400, "": 60}
+massa_pendentes = {}  # (guild_id, autor_id) -> (timestamp, ação, [member_ids], minutos, descrição)
+
+def parse_duracao(texto: str) -> timedelta:
+    m = DURACAO_REGEX.match(texto.strip().lower())
+    if not m:
+        raise ValueError(texto)
+    return timedelta(seconds=int(m.group(1)) * _UNIDADES_DURACAO[m.group(2)])
+
+def filtros_massa(guild: discord.Guild, termos: list) -> list:
+    # cada termo chave:valor vira um predicado; todos precisam bater
+    agora = discord.utils.utcnow()
+    filtros = []
+    for termo in termos:
+        chave, _, valor = termo.partition(":")
+        chave = chave.lower()
+        if not valor:
+            raise ValueError(termo)
+        if chave == "entrou":
+            limite = agora - parse_duracao(valor)
+            filtros.append(lambda m, limite=limite: m.joined_at is not None and m.joined_at >= limite)
+        elif chave == "idade":
+            limite = agora - parse_duracao(valor if valor[-1].isalpha() else valor + "d")
+            filtros.append(lambda m, limite=limite: m.created_at >= limite)
+        elif chave == "convite":
+            ids = {
+                member_id for (g, member_id), registro in livro_convites.convite_de.items()
+                if g == guild.id and registro["ativo"] and registro["codigo"] == valor
+            }
+            filtros.append(lambda m, ids=ids: m.id in ids)
+        elif chave == "nome":
+            padrao = re.compile(valor, re.IGNORECASE)
+            filtros.append(lambda m, padrao=padrao: bool(padrao.search(m.name) or padrao.search(m.display_name)))
+        elif chave == "cargo":
+            mencao = CARGO_MENCAO_REGEX.match(valor)
+            if mencao:
+                cargo = guild.get_role(int(mencao.group(1)))
+            else:
+                cargo = discord.utils.find(lambda r: r.name.lower() == valor.lower(), guild.roles)
+            if cargo is None:
+                raise ValueError(termo)
+            filtros.append(lambda m, cargo_id=cargo.id: m._roles.has(cargo_id))
+        else:
+            raise ValueError(termo)
+    return filtros
+
+def selecionar_membros(membros: list, filtros: list, autor: discord.Member) -> list:
+    return [
+        m for m in membros
+        if not m.bot and m.id != autor.id and not is_exempt(m) and all(f(m) for f in filtros)
+    ]
+
+async def executar_massa(guild: discord.Guild, acao: str, alvos: list, motivo: str, minutos: int) -> tuple:
+    # devolve (sucessos, falhas)
+    if acao == "ban":
+        banidos = await banir_em_lote(guild, alvos, motivo)
+        return len(banidos), len(alvos) - len(banidos)
+    if acao == "kick":
+        resultado = await fan_out(
+            alvos,
+            lambda m: m.kick(reason=motivo),
+            rota="kick",
+            prioridade=REST_PUNICAO,
+            chave=lambda m: ("kick", m.guild.id, m.id)
+        )
+    else:
+        resultado = await fan_out(alvos, lambda m: aplicar_mute_texto(guild, m, minutos, motivo, None), limite=3)
+    return resultado.ok, len(resultado.falhas)
+
 # COMANDOS COM PREFIXO .
 @bot.command(name="menu_admin")
 async def menu_admin(ctx):
@@ -699,7 +2708,7 @@ async def menu_admin(ctx):
     if not tem_cargo_admin(ctx.author):
         await ctx.send("🚫 sem permissão")
         return
-    texto = "🧹 .clear \n🔨 .ban <usuário(s)>\n🔇 .mute <usuário(s)>\n🚫 .link <on|off>\n💬 .falar \n🔊 .mutecall <on|off>\n🌐 .muteall <on|off>"
+    texto = "🧹 .clear \n🔨 .ban <usuário(s)>\n🔇 .mute <usuário(s)>\n🚫 .link <on|off>\n💬 .falar \n🔊 .mutecall <on|off>\n🌐 .muteall <on|off>\n⚙️ .mutemodo <canais|cargo|timeout>\n📊 .regras\n📈 .stats\n🧠 .memoria\n📥 .rest\n🐢 .travamentos [n|pilha <i>]\n📨 .convites [@usuário]\n🏆 .topconvites [n]\n🚨 .raid [on|off|acao]\n🧨 .massa <ban|kick|mute> <filtros>"
     embed = discord.Embed(title="👑 Menu Administrativo", description=texto, color=discord.Color.gold())
     await ctx.send(embed=embed)
 
@@ -715,8 +2724,26 @@ async def clear(ctx, quantidade: int):
         return
         
     try:
-        deleted = await ctx.channel.purge(limit=quantidade + 1)  # +1 para incluir o comando
-        embed = discord.Embed(title="🧹 Limpeza concluída", description=f"{len(deleted) - 1} mensagens apagadas", color=discord.Color.dark_gray())
+        canal = ctx.channel
+        mensagens = await agendador_rest.executar(
+            lambda: _historico(canal, quantidade + 1),  # +1 para incluir o comando
+            rota="historico",
+            prioridade=REST_AVISO,
+            bucket=canal.id
+        )
+        # bulk delete só aceita mensagens de até 14 dias; as mais velhas saem uma a uma
+        limite = discord.utils.utcnow() - timedelta(days=BULK_DELETE_DIAS)
+        apagadas = await apagar_mensagens(ctx.guild, [(canal.id, m.id) for m in mensagens if m.created_at > limite])
+        resultado = await fan_out(
+            [m for m in mensagens if m.created_at <= limite],
+            lambda m: m.delete(),
+            rota="apagar_mensagens",
+            prioridade=REST_AVISO,
+            bucket=lambda m: canal.id,
+            chave=lambda m: ("apagar", m.id)
+        )
+        apagadas += resultado.ok
+        embed = discord.Embed(title="🧹 Limpeza concluída", description=f"{max(apagadas - 1, 0)} mensagens apagadas", color=discord.Color.dark_gray())
         await ctx.send(embed=embed, delete_after=10)
     except Exception:
         await ctx.send("❌ erro ao apagar mensagens")
@@ -731,22 +2758,22 @@ async def ban(ctx, *, usuario: str):
     membros_alvo = []
     
     if tem_cargo_soberba(ctx.author):
-        mencoes = re.findall(r'<@!?(\d+)>', usuario)
+        mencoes = MENCAO_REGEX.findall(usuario)
         if not mencoes:
             await ctx.send("❌ Soberba: Você deve mencionar um ou mais usuários.")
             return
         
         for user_id in mencoes:
-            member = ctx.guild.get_member(int(user_id))
+            member = await obter_membro(ctx.guild, int(user_id))
             if member:
                 membros_alvo.append(member)
     else:
-        mencoes = re.findall(r'<@!?(\d+)>', usuario)
+        mencoes = MENCAO_REGEX.findall(usuario)
         if len(mencoes) != 1:
             await ctx.send("❌ Ira: Você deve mencionar exatamente um usuário.")
             return
         
-        member = ctx.guild.get_member(int(mencoes[0]))
+        member = await obter_membro(ctx.guild, int(mencoes[0]))
         if member:
             membros_alvo.append(member)
         else:
@@ -757,15 +2784,8 @@ async def ban(ctx, *, usuario: str):
         await ctx.send("❌ Nenhum usuário válido encontrado para banir.")
         return
 
-    banidos = []
-    erros = []
-    
-    for membro in membros_alvo:
-        try:
-            await ctx.guild.ban(membro, reason=f"Banido por {ctx.author}")
-            banidos.append(membro.mention)
-        except Exception:
-            erros.append(membro.mention)
+    ids_banidos = await banir_em_lote(ctx.guild, membros_alvo, f"Banido por {ctx.author}")
+    banidos = [membro.mention for membro in membros_alvo if membro.id in ids_banidos]
 
     if banidos:
         embed = discord.Embed(title="🔨 Banido(s)", description=f"{', '.join(banidos)} foram banidos.", color=discord.Color.red())
@@ -787,22 +2807,22 @@ async def mute(ctx, tempo: int, *, usuario: str):
     membros_alvo = []
     
     if tem_cargo_soberba(ctx.author):
-        mencoes = re.findall(r'<@!?(\d+)>', usuario)
+        mencoes = MENCAO_REGEX.findall(usuario)
         if not mencoes:
             await ctx.send("❌ Soberba: Você deve mencionar um ou mais usuários.")
             return
         
         for user_id in mencoes:
-            member = ctx.guild.get_member(int(user_id))
+            member = await obter_membro(ctx.guild, int(user_id))
             if member:
                 membros_alvo.append(member)
     else:
-        mencoes = re.findall(r'<@!?(\d+)>', usuario)
+        mencoes = MENCAO_REGEX.findall(usuario)
         if len(mencoes) != 1:
             await ctx.send("❌ Ira: Você deve mencionar exatamente um usuário.")
             return
         
-        member = ctx.guild.get_member(int(mencoes[0]))
+        member = await obter_membro(ctx.guild, int(mencoes[0]))
         if member:
             membros_alvo.append(member)
         else:
@@ -813,16 +2833,16 @@ async def mute(ctx, tempo: int, *, usuario: str):
         await ctx.send("❌ Nenhum usuário válido encontrado para mutar.")
         return
 
-    canal_log = discord.utils.get(ctx.guild.text_channels, name="mod-logs")
+    canal_log = canal_log_de(ctx.guild)
     tempo_formatado = format_tempo(tempo)
-    mutados = []
     
-    for membro in membros_alvo:
-        try:
-            await aplicar_mute_texto(ctx.guild, membro, tempo, f"Comando por {ctx.author}", canal_log)
-            mutados.append(membro.mention)
-        except Exception:
-            pass
+    resultado = await fan_out(
+        membros_alvo,
+        lambda membro: aplicar_mute_texto(ctx.guild, membro, tempo, f"Comando por {ctx.author}", canal_log),
+        limite=3
+    )
+    falhos = {membro.id for membro, _ in resultado.falhas}
+    mutados = [membro.mention for membro in membros_alvo if membro.id not in falhos]
 
     if mutados:
         embed = discord.Embed(
@@ -834,18 +2854,313 @@ async def mute(ctx, tempo: int, *, usuario: str):
     else:
         await ctx.send("❌ Erro ao mutar os usuários mencionados.")
 
+@bot.command(name="mutemodo")
+async def mutemodo(ctx, modo: str = None):
+    """Define como o mute de texto é aplicado - .mutemodo <canais|cargo|timeout>"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    if modo is None:
+        await ctx.send(f"⚙️ modo de mute atual: **{backend_mute(ctx.guild)}** (opções: {', '.join(MUTE_BACKENDS)})")
+        return
+    
+    modo = modo.lower()
+    if modo not in MUTE_BACKENDS:
+        await ctx.send(f"❌ use {', '.join(MUTE_BACKENDS)}.")
+        return
+    
+    if modo == "cargo":
+        cargo = await obter_cargo_mutado(ctx.guild)
+        if cargo is None:
+            await ctx.send("❌ não consegui criar o cargo de mute.")
+            return
+    
+    mute_backend_por_guild[ctx.guild.id] = modo
+    embed = discord.Embed(title="⚙️ Modo de mute alterado", description=f"Novos mutes usarão **{modo}**.", color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(name="regras")
+async def regras(ctx):
+    """Estatísticas das regras de moderação - .regras"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    linhas = []
+    for r in REGRAS_MENSAGEM:
+        media = (r.tempo / r.avaliacoes * 1000) if r.avaliacoes else 0.0
+        linhas.append(f"`{r.nome}` — {r.avaliacoes} avaliações, {r.acertos} acertos, {media:.2f}ms em média")
+    embed = discord.Embed(title="📊 Regras de moderação", description="\n".join(linhas), color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(name="stats")
+async def stats(ctx):
+    """Uso de memória do estado de moderação - .stats"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    memoria = usuarios.memoria_estimada()
+    texto = (
+        f"👥 usuários rastreados: {len(usuarios)} / {usuarios.maximo}\n"
+        f"🧠 memória estimada: {memoria / 1024:.1f} KiB\n"
+        f"🧹 despejos: {usuarios.despejos_ttl} por inatividade, {usuarios.despejos_lru} pelo teto\n"
+        f"🔇 mutes ativos: {len(text_mutes)} · níveis de mute: {len(mute_level)}\n"
+        f"📨 convites: {rastreador_convites.buscas} buscas para {rastreador_convites.entradas} entradas\n"
+        f"💾 gravações pendentes: {estado.pendentes()}"
+    )
+    if prontidao:
+        texto += f"\n⏱️ startup: {resumo_prontidao()}"
+    if AUTO_SHARD:
+        texto += f"\n🧩 shard {ctx.guild.shard_id} · shards deste processo: {sorted(bot.shards)} de {bot.shard_count}"
+    embed = discord.Embed(title="📈 Estado do bot", description=texto, color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+def rss_atual() -> int:
+    # /proc dá o RSS de agora; fora do Linux fica o pico do getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == "darwin" else pico * 1024
+
+def caches_discord() -> dict:
+    return {
+        "mensagens": len(bot.cached_messages),
+        "membros": sum(len(g.members) for g in bot.guilds),
+        "usuarios": len(bot.users),
+        "canais": sum(len(g.channels) for g in bot.guilds),
+        "servidores": len(bot.guilds)
+    }
+
+@bot.command(name="memoria")
+async def memoria(ctx):
+    """Memória do processo e dos caches - .memoria"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    rss = rss_atual() / 1024 / 1024
+    caches = caches_discord()
+    linhas = [f"⚙️ perfil: `{PERFIL_CACHE}` · cache de mensagens: {MAX_MENSAGENS or 'desligado'}"]
+    if ORCAMENTO_RSS_MB:
+        alerta = " ⚠️ acima do orçamento" if rss > ORCAMENTO_RSS_MB else ""
+        linhas.append(f"💽 RSS: {rss:.1f} MiB de {ORCAMENTO_RSS_MB} MiB ({rss / ORCAMENTO_RSS_MB:.0%}){alerta}")
+    else:
+        linhas.append(f"💽 RSS: {rss:.1f} MiB")
+    linhas.append(
+        f"📚 discord.py: {caches['mensagens']} mensagens · {caches['membros']} membros · "
+        f"{caches['usuarios']} usuários · {caches['canais']} canais em {caches['servidores']} servidores"
+    )
+    linhas.append(
+        f"👥 moderação: {len(usuarios)} registros (~{usuarios.memoria_estimada() / 1024:.1f} KiB) · "
+        f"{len(indice_recentes)} mensagens indexadas para limpeza"
+    )
+    linhas.append("💾 tabelas: " + " · ".join(f"{nome} {len(t)}" for nome, t in estado.tabelas.items()))
+    embed = discord.Embed(title="🧠 Memória", description="\n".join(linhas), color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(name="rest")
+async def rest(ctx):
+    """Fila de chamadas REST de moderação - .rest"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    embed = discord.Embed(title="📥 Agendador REST", description=agendador_rest.resumo(), color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(name="travamentos")
+async def travamentos(ctx, *args):
+    """Últimos travamentos do event loop - .travamentos [n] ou .travamentos pilha <i>"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    registros = list(watchdog_loop.registros)[::-1]  # mais recente primeiro
+    if args and args[0].lower() == "pilha":
+        try:
+            t = registros[int(args[1]) - 1]
+        except (IndexError, ValueError):
+            await ctx.send(f"❌ use .travamentos pilha <1-{len(registros) or 1}>.")
+            return
+        pilha = "".join(t.pilha) or "(sem amostra de pilha)"
+        await ctx.send(f"```\n{pilha[-1900:]}\n```")
+        return
+    
+    try:
+        n = max(1, min(int(args[0]), 20)) if args else 10
+    except ValueError:
+        await ctx.send("❌ use .travamentos [n] ou .travamentos pilha <i>.")
+        return
+    linhas = [
+        f"🐢 atraso máximo: {watchdog_loop.maior_atraso * 1000:.0f}ms · limiar: {WATCHDOG_LIMIAR * 1000:.0f}ms · "
+        f"{len(registros)} travamentos guardados"
+    ]
+    for i, t in enumerate(registros[:n], 1):
+        quando = datetime.fromtimestamp(t.inicio).strftime("%d/%m %H:%M:%S")
+        duracao = f"{t.duracao * 1000:.0f}ms" if t.duracao is not None else "em curso"
+        regra = f" (regra {t.regra})" if t.regra else ""
+        linhas.append(f"`{i}` {quando} · {duracao} · {t.handler}{regra}")
+    embed = discord.Embed(title="🐢 Travamentos do event loop", description="\n".join(linhas), color=discord.Color.orange())
+    await ctx.send(embed=embed)
+
+@bot.command(name="convites")
+async def convites(ctx, membro: discord.Member = None):
+    """Convites de um usuário - .convites [@usuário]"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    membro = membro or ctx.author
+    c = livro_convites.contagem_de(ctx.guild.id, membro.id)
+    convidado_por = livro_convites.convidado_por(ctx.guild.id, membro.id)
+    texto = (
+        f"✅ {c['ativos']} no servidor · 🚪 {c['saidas']} saíram · 🤖 {c['falsos']} contas novas · 🔁 {c['reentradas']} reentradas"
+    )
+    if convidado_por:
+        texto += f"\n📨 convidado por <@{convidado_por}>"
+    embed = discord.Embed(title=f"📨 Convites de {membro.display_name}", description=texto, color=discord.Color.blurple())
+    await ctx.send(embed=embed)
+
+@bot.command(name="topconvites")
+async def topconvites(ctx, quantidade: int = 10):
+    """Ranking de convites - .topconvites [n]"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    quantidade = max(1, min(quantidade, 25))
+    ranking = livro_convites.top(ctx.guild.id, quantidade)
+    if not ranking:
+        await ctx.send("❌ nenhum convite registrado ainda.")
+        return
+    linhas = [
+        f"**{pos}.** <@{inviter_id}> — {c['ativos'] - c['falsos']} válidos ({c['ativos']} no servidor, {c['saidas']} saíram, {c['falsos']} contas novas)"
+        for pos, (inviter_id, c) in enumerate(ranking, start=1)
+    ]
+    embed = discord.Embed(title="🏆 Top convites", description="\n".join(linhas), color=discord.Color.gold())
+    await ctx.send(embed=embed)
+
+@bot.command(name="raid")
+async def raid(ctx, estado_raid: str = None, acao: str = None):
+    """Modo raid - .raid [on|off|acao <ban|kick|nenhuma>]"""
+    if not tem_cargo_admin(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    guild = ctx.guild
+    if estado_raid is None:
+        ativo = "ativo" if detector_raid.ativo(guild.id) else "inativo"
+        texto = (
+            f"🚨 modo raid: **{ativo}** · ação: **{raid_acao_por_guild.get(guild.id, 'ban')}**\n"
+            f"👥 {len(detector_raid.entradas.get(guild.id, ()))} entradas nos últimos {RAID_JANELA:.0f}s\n"
+            f"🔨 {detector_raid.punidos[guild.id]} contas punidas · 🔒 {len(detector_raid.quarentena.get(guild.id, ()))} em quarentena"
+        )
+        embed = discord.Embed(title="🚨 Modo raid", description=texto, color=discord.Color.dark_red())
+        await ctx.send(embed=embed)
+        return
+    
+    estado_raid = estado_raid.lower()
+    if estado_raid == "on":
+        if not detector_raid.ativo(guild.id):
+            detector_raid.ativos[guild.id] = time.time() + RAID_DURACAO
+            await iniciar_modo_raid(guild)
+        await ctx.send("🚨 modo raid ativado.")
+    elif estado_raid == "off":
+        await encerrar_modo_raid(guild)
+        await ctx.send("✅ modo raid desativado.")
+    elif estado_raid == "acao" and acao and acao.lower() in RAID_ACOES:
+        raid_acao_por_guild[guild.id] = acao.lower()
+        await ctx.send(f"⚙️ ação do modo raid: **{acao.lower()}**")
+    else:
+        await ctx.send(f"❌ use on, off ou acao <{'|'.join(RAID_ACOES)}>.")
+
+@bot.command(name="massa")
+async def massa(ctx, acao: str, *termos: str):
+    """Ação em massa por filtro - .massa <ban|kick|mute> entrou:30m idade:3d convite:abc nome:regex cargo:nome [tempo:60] · .massa confirmar"""
+    if not tem_cargo_soberba(ctx.author):
+        await ctx.send("🚫 sem permissão")
+        return
+    
+    guild = ctx.guild
+    chave = (guild.id, ctx.author.id)
+    acao = acao.lower()
+    
+    if acao == "confirmar":
+        pendente = massa_pendentes.pop(chave, None)
+        if pendente is None or time.time() - pendente[0] > MASSA_PREVIA_VALIDADE:
+            await ctx.send("❌ nenhuma prévia pendente; rode o comando com os filtros primeiro.")
+            return
+        _, acao, ids, minutos, descricao = pendente
+        alvos = await obter_membros(guild, ids)
+        inicio = time.perf_counter()
+        ok, falhas = await executar_massa(guild, acao, alvos, f"Ação em massa por {ctx.author}: {descricao}", minutos)
+        embed = discord.Embed(
+            title=f"🧨 Ação em massa concluída ({acao})",
+            description=f"{ok} membros afetados, {falhas} falhas em {time.perf_counter() - inicio:.1f}s.\nFiltro: {descricao}",
+            color=discord.Color.dark_red(),
+            timestamp=datetime.utcnow()
+        )
+        await ctx.send(embed=embed)
+        enviar_log(canal_log_de(guild), embed, prioridade=LOG_ALTA)
+        return
+    
+    if acao not in MASSA_ACOES:
+        await ctx.send(f"❌ use {', '.join(MASSA_ACOES)} ou confirmar.")
+        return
+    
+    minutos = MASSA_MUTE_PADRAO
+    filtros_texto = []
+    for termo in termos:
+        if termo.lower().startswith("tempo:"):
+            try:
+                minutos = max(1, min(int(parse_duracao(termo[6:]).total_seconds() // 60), 10080))
+            except ValueError:
+                await ctx.send(f"❌ tempo inválido: `{termo}`")
+                return
+        else:
+            filtros_texto.append(termo)
+    if not filtros_texto:
+        await ctx.send("❌ informe ao menos um filtro (entrou:, idade:, convite:, nome:, cargo:).")
+        return
+    
+    try:
+        filtros = filtros_massa(guild, filtros_texto)
+    except (ValueError, re.error) as e:
+        await ctx.send(f"❌ filtro inválido: `{e}`")
+        return
+    
+    alvos = selecionar_membros(await listar_membros(guild), filtros, ctx.author)
+    if not alvos:
+        await ctx.send("❌ nenhum membro bate com esse filtro.")
+        return
+    
+    descricao = " ".join(filtros_texto)
+    massa_pendentes[chave] = (time.time(), acao, [m.id for m in alvos], minutos, descricao)
+    amostra = ", ".join(m.mention for m in alvos[:10]) + (" …" if len(alvos) > 10 else "")
+    extra = f" por {format_tempo(minutos)}" if acao == "mute" else ""
+    embed = discord.Embed(
+        title=f"🔎 Prévia: {acao}{extra}",
+        description=f"**{len(alvos)}** membros selecionados.\n{amostra}\n\nUse `.massa confirmar` em até {MASSA_PREVIA_VALIDADE:.0f}s para executar.",
+        color=discord.Color.orange()
+    )
+    await ctx.send(embed=embed)
+
 @bot.command(name="link")
 async def link(ctx, estado: str):
     """Ativa/desativa antilink - .link on ou .link off"""
-    global antilink_ativo
     if not tem_cargo_admin(ctx.author):
         await ctx.send("🚫 sem permissão")
         return
     if estado.lower() == "on":
-        antilink_ativo = True
+        antilink_por_guild.pop(ctx.guild.id, None)
         embed = discord.Embed(title="🚫 Antilink ativado", color=discord.Color.red())
     elif estado.lower() == "off":
-        antilink_ativo = False
+        antilink_por_guild[ctx.guild.id] = False
         embed = discord.Embed(title="✅ Antilink desativado", color=discord.Color.green())
     else:
         await ctx.send("❌ use on ou off.")
@@ -867,23 +3182,18 @@ async def falar(ctx, *, mensagem: str):
 @bot.command(name="mutecall")
 async def mutecall(ctx, estado: str):
     """Muta/desmuta todos em call - .mutecall on ou .mutecall off"""
-    global mute_call_ativo
     if not tem_cargo_admin(ctx.author):
         await ctx.send("🚫 sem permissão")
         return
     
-    canal_log = discord.utils.get(ctx.guild.text_channels, name="mod-logs")
+    canal_log = canal_log_de(ctx.guild)
     
     if estado.lower() == "on":
-        mute_call_ativo = True
-        for voice_channel in ctx.guild.voice_channels:
-            await aplicar_mute_call(ctx.guild, voice_channel, f"Comando por {ctx.author}", canal_log)
-        embed = discord.Embed(title="🔇 Mute em Call Ativado", color=discord.Color.orange())
+        resultado = await aplicar_mute_call(ctx.guild, f"Comando por {ctx.author}", canal_log)
+        embed = discord.Embed(title="🔇 Mute em Call Ativado", description=f"{resultado.ok} membros mutados.", color=discord.Color.orange())
     elif estado.lower() == "off":
-        mute_call_ativo = False
-        for voice_channel in ctx.guild.voice_channels:
-            await remover_mute_call(ctx.guild, voice_channel, canal_log)
-        embed = discord.Embed(title="🔊 Mute em Call Desativado", color=discord.Color.green())
+        resultado = await remover_mute_call(ctx.guild, canal_log)
+        embed = discord.Embed(title="🔊 Mute em Call Desativado", description=f"{resultado.ok} membros desmutados.", color=discord.Color.green())
     else:
         await ctx.send("❌ use on ou off.")
         return
@@ -892,21 +3202,21 @@ async def mutecall(ctx, estado: str):
 @bot.command(name="muteall")
 async def muteall(ctx, estado: str):
     """Muta/desmuta todos os canais de texto - .muteall on ou .muteall off"""
-    global mute_all_ativo
     if not tem_cargo_admin(ctx.author):
         await ctx.send("🚫 sem permissão")
         return
     
     if estado.lower() == "on":
-        mute_all_ativo = True
-        canais_bloqueados = await bloquear_todos_canais_texto(ctx.guild, f"Comando por {ctx.author}")
+        # um lockdown do modo raid passa a ser do .muteall: o fim do raid não destranca
+        detector_raid.bloqueou.discard(ctx.guild.id)
+        canais_bloqueados = await bloquear_todos_canais_texto(ctx.guild, f"Comando por {ctx.author}", assumir=True)
         embed = discord.Embed(
             title="🌐 MUTEALL ATIVADO", 
             description=f"Todos os canais de texto foram bloqueados.\n{canais_bloqueados} canais afetados.",
             color=discord.Color.dark_red()
         )
     elif estado.lower() == "off":
-        mute_all_ativo = False
+        detector_raid.bloqueou.discard(ctx.guild.id)
         canais_desbloqueados = await desbloquear_todos_canais_texto(ctx.guild)
         embed = discord.Embed(
             title="🌐 MUTEALL DESATIVADO", 
@@ -919,10 +3229,80 @@ async def muteall(ctx, estado: str):
     await ctx.send(embed=embed)
 
 @bot.event
+@medido("evento")
+async def on_guild_join(guild: discord.Guild):
+    indexar_cargos(guild)
+
+@bot.event
+@medido("evento")
+async def on_guild_remove(guild: discord.Guild):
+    cargos_por_guild.pop(guild.id, None)
+    diretorios_canais.pop(guild.id, None)
+
+@bot.event
+@medido("evento")
+async def on_guild_role_create(role: discord.Role):
+    if role.name.lower() in CARGOS_INDEXADOS:
+        indexar_cargos(role.guild)
+
+@bot.event
+@medido("evento")
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    if before.name != after.name:
+        indexar_cargos(after.guild)
+
+@bot.event
+@medido("evento")
+async def on_guild_role_delete(role: discord.Role):
+    if role.name.lower() in CARGOS_INDEXADOS:
+        indexar_cargos(role.guild)
+
+@bot.event
+@medido("evento")
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    if not isinstance(channel, discord.TextChannel):
+        return
+    guild = channel.guild
+    diretorio_canais(guild).adicionar(channel)
+    cargo = guild.get_role(_cargo_mutado_id.get(guild.id, 0))
+    if cargo is not None:
+        await sincronizar_cargo_mutado(guild, cargo, [channel])
+    if em_lockdown(guild):
+        await bloquear_todos_canais_texto(guild, lockdown_por_guild[guild.id]["motivo"], [channel])
+    
+    # mutes por canal ativos também precisam valer no canal novo
+    ids = [
+        user_id for (guild_id, user_id), backend in list(text_mutes_backend.items())
+        if guild_id == guild.id and backend == "canais"
+    ]
+    mutados = [m for m in await asyncio.gather(*(obter_membro(guild, user_id) for user_id in ids)) if m is not None]
+    if mutados:
+        await fan_out(
+            mutados,
+            lambda member: channel.set_permissions(member, send_messages=False),
+            rota="permissao_canal",
+            bucket=lambda member: channel.id
+        )
+
+@bot.event
+@medido("evento")
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if not isinstance(after, discord.TextChannel) or before.name == after.name:
+        return
+    d = diretorios_canais.get(after.guild.id)
+    if d is not None:
+        d.remover(after.id)
+        d.adicionar(after)
+
+@bot.event
+@medido("evento")
 async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
     if not isinstance(channel, discord.TextChannel):
         return
     cid = channel.id
+    d = diretorios_canais.get(channel.guild.id)
+    if d is not None:
+        d.remover(cid)
     if cid in active_channels:
         data = active_channels.get(cid, {})
         u1 = data.get("u1")
@@ -937,53 +3317,252 @@ async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
             pass
 
 @bot.event
+@medido("evento")
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-    if mute_call_ativo and after.channel and not is_exempt(member):
+    if after.channel is None:
+        return
+    guild = member.guild
+    if mute_call_ativo(guild):
+        # já com mute de servidor (inclui self-mute/stream de quem já foi mutado): nada a fazer
+        if after.mute or is_exempt(member):
+            return
         try:
-            await member.edit(mute=True)
+            await _editar_mute_voz(member, True, "mute em call ativo")
+            await _anotar_mutados(guild, [member])
+        except Exception:
+            pass
+    elif after.mute and member.id in desmute_pendente.get(guild.id, ()):
+        try:
+            await _editar_mute_voz(member, False, "fim do mute em call")
+            _anotar_voz(desmute_pendente, guild.id, [member.id], remover=True)
+        except Exception:
+            pass
+
+# 🆕 TRAVA DE APELIDO PELO AUDIT LOG (a entrada traz alvo, autor e apelidos mesmo sem o membro em cache)
+NICK_DEBOUNCE = 2.0
+
+_reversoes_nick = {}  # (guild_id, member_id) -> task
+
+def agendar_reversao_nick(guild: discord.Guild, member_id: int):
+    # várias trocas seguidas viram uma única edição
+    chave = (guild.id, member_id)
+    if chave in _reversoes_nick:
+        return
+    _reversoes_nick[chave] = asyncio.create_task(_reverter_nick(guild, member_id))
+
+async def _reverter_nick(guild: discord.Guild, member_id: int):
+    try:
+        await asyncio.sleep(NICK_DEBOUNCE)
+    finally:
+        _reversoes_nick.pop((guild.id, member_id), None)
+    b = blocked_nick.get((guild.id, member_id), None)
+    if b is None:
+        return
+    member = await obter_membro(guild, member_id)
+    if member is not None and member.nick != b:
+        try:
+            await agendador_rest.executar(
+                lambda: member.edit(nick=b, reason="revertido por bot: apelido bloqueado por soberba"),
+                rota="apelido",
+                chave=("apelido", guild.id, member_id)
+            )
         except Exception:
             pass
 
 @bot.event
-async def on_member_update(before: discord.Member, after: discord.Member):
+@medido("evento")
+async def on_audit_log_entry_create(entry: discord.AuditLogEntry):
+    if entry.action != discord.AuditLogAction.member_update:
+        return
+    if not (hasattr(entry.after, "nick") or hasattr(entry.before, "nick")):
+        return
+    target_id = getattr(entry.target, "id", None)
+    if target_id is None or entry.user_id is None:
+        return
     try:
-        if before.nick == after.nick:
-            b = blocked_nick.get(after.id, None)
-            if b is not None:
-                if after.nick != b:
-                    try:
-                        await after.edit(nick=b, reason="revertido por bot: apelido bloqueado por soberba")
-                    except Exception:
-                        pass
+        guild = entry.guild
+        nick = getattr(entry.after, "nick", None)
+        b = blocked_nick.get((guild.id, target_id), None)
+        # sem como mudar o resultado, nem busca o autor: apelido igual à trava, ou troca própria sem trava
+        if nick == b or (b is None and entry.user_id == target_id):
             return
-
-        guild = after.guild
-        entry = None
-        async for e in guild.audit_logs(limit=5, action=discord.AuditLogAction.member_update):
-            if e.target.id == after.id:
-                entry = e
-                break
-        if entry and entry.user:
-            actor = entry.user
-            if tem_cargo_soberba(actor):
-                if after.nick is None:
-                    if after.id in blocked_nick:
-                        del blocked_nick[after.id]
-                else:
-                    blocked_nick[after.id] = after.nick
+        actor = await obter_membro(guild, entry.user_id)
+        if actor is not None and tem_cargo_soberba(actor):
+            if nick is None:
+                blocked_nick.pop((guild.id, target_id), None)
             else:
-                b = blocked_nick.get(after.id, None)
-                if b is not None and after.nick != b:
-                    try:
-                        await after.edit(nick=b, reason="revertido por bot: apelido bloqueado por soberba")
-                    except Exception:
-                        pass
+                blocked_nick[(guild.id, target_id)] = nick
+        elif b is not None:
+            agendar_reversao_nick(guild, target_id)
     except Exception:
         return
 
+@bot.event
+@medido("evento")
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # só chega para membros em cache; trocas de apelido são tratadas pelo audit log acima
+    if before.nick != after.nick:
+        return
+    b = blocked_nick.get((after.guild.id, after.id), None)
+    if b is not None and after.nick != b:
+        agendar_reversao_nick(after.guild, after.id)
+
+# 🆕 MÉTRICAS: séries calculadas na coleta, comandos e endpoint /metrics
+@coletado("illumi_tabela_tamanho", "gauge", "entradas em cada tabela de estado em memória", ("tabela",))
+def _tamanhos_tabelas():
+    for nome, t in estado.tabelas.items():
+        yield (nome,), len(t)
+    yield ("usuarios",), len(usuarios)
+    yield ("active_channels",), len(active_channels)
+    yield ("active_users",), len(active_users)
+    yield ("massa_pendentes",), len(massa_pendentes)
+    yield ("agendador_mutes",), len(agendador_mutes)
+    yield ("indice_recentes",), len(indice_recentes)
+
+@coletado("illumi_rss_bytes", "gauge", "memória residente do processo")
+def _rss():
+    yield (), rss_atual()
+
+@coletado("illumi_cache_discord", "gauge", "objetos nos caches do discord.py", ("cache",))
+def _caches_discord():
+    for nome, n in caches_discord().items():
+        yield (nome,), n
+
+@coletado("illumi_usuarios_memoria_bytes", "gauge", "memória estimada dos registros por usuário")
+def _memoria_usuarios():
+    yield (), usuarios.memoria_estimada()
+
+def _por_regra(campo: str):
+    def coletar():
+        for r in REGRAS_MENSAGEM:
+            yield (r.nome,), getattr(r, campo)
+    return coletar
+
+def _por_rota(campo: str):
+    def coletar():
+        for rota, r in list(agendador_rest.rotas.items()):
+            yield (rota,), getattr(r, campo)
+    return coletar
+
+for _nome, _campo, _ajuda in (
+    ("illumi_regra_avaliacoes_total", "avaliacoes", "vezes que a regra rodou"),
+    ("illumi_regra_acertos_total", "acertos", "vezes que a regra agiu e parou o pipeline"),
+    ("illumi_regra_segundos_total", "tempo", "tempo gasto dentro da regra"),
+):
+    metricas.registrar(Coletor(_nome, "counter", _ajuda, ("regra",), _por_regra(_campo)))
+
+for _nome, _campo, _ajuda in (
+    ("illumi_rest_chamadas_total", "chamadas", "chamadas REST feitas, incluindo retries"),
+    ("illumi_rest_falhas_total", "falhas", "ações REST que falharam de vez"),
+    ("illumi_rest_429_total", "limitadas", "respostas 429 recebidas"),
+    ("illumi_rest_deduplicadas_total", "deduplicadas", "ações juntadas a uma idêntica já pendente"),
+):
+    metricas.registrar(Coletor(_nome, "counter", _ajuda, ("rota",), _por_rota(_campo)))
+
+@coletado("illumi_rest_fila", "gauge", "ações na fila do agendador REST", ("prioridade",))
+def _fila_rest():
+    for nome, n in zip(REST_PRIORIDADES, agendador_rest.profundidade()):
+        yield (nome,), n
+    yield ("em_curso",), agendador_rest.em_curso
+
+@coletado("illumi_logs", "gauge", "fila de mod-logs", ("estado",))
+def _fila_logs():
+    yield ("pendentes",), fila_logs.pendentes()
+    yield ("enviados",), fila_logs.enviados
+    yield ("descartados",), fila_logs.descartados
+
+@coletado("illumi_prontidao_segundos", "gauge", "duração de cada fase do último startup", ("fase",))
+def _prontidao():
+    for nome, segundos, _ in prontidao:
+        yield (nome,), segundos
+
+@coletado("illumi_estado_pendentes", "gauge", "linhas de estado esperando gravação")
+def _estado_pendentes():
+    yield (), estado.pendentes()
+
+@bot.before_invoke
+async def _inicio_comando(ctx):
+    ctx.inicio_metricas = time.perf_counter()
+
+@bot.after_invoke
+async def _fim_comando(ctx):
+    # roda mesmo quando o comando levanta exceção
+    nome = ctx.command.qualified_name if ctx.command else "?"
+    inicio = getattr(ctx, "inicio_metricas", None)
+    if inicio is not None:
+        latencia_handlers.observar(time.perf_counter() - inicio, "comando", nome)
+    if ctx.command_failed:
+        erros_handlers.inc("comando", nome)
+
+async def _rota_metricas(request: web.Request) -> web.Response:
+    return web.Response(
+        body=metricas.renderizar().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+_servidor_metricas = None
+
+async def iniciar_metricas():
+    global _servidor_metricas
+    if _servidor_metricas is not None or not METRICAS_PORTA:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _rota_metricas)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICAS_HOST, METRICAS_PORTA).start()
+    except OSError as e:
+        print(f"⚠️ métricas: não consegui abrir {METRICAS_HOST}:{METRICAS_PORTA} ({e})")
+        await runner.cleanup()
+        return
+    _servidor_metricas = runner
+    print(f"📊 métricas em http://{METRICAS_HOST}:{METRICAS_PORTA}/metrics")
+
+def rodar_workers(workers: int):
+    # um processo por fatia de shards; todos gravam no mesmo SQLite, cada um só nas linhas dos seus servidores
+    total = SHARD_COUNT or workers
+    processos = {}
+
+    def iniciar(i: int):
+        env = dict(os.environ, AUTO_SHARD="1", SHARD_COUNT=str(total), SHARD_WORKERS="0")
+        env["SHARD_IDS"] = ",".join(str(shard) for shard in range(i, total, workers))
+        if METRICAS_PORTA:
+            env["METRICAS_PORTA"] = str(METRICAS_PORTA + i)
+        processos[i] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        print(f"🧩 worker {i}: shards {env['SHARD_IDS']} de {total} (pid {processos[i].pid})")
+
+    for i in range(workers):
+        iniciar(i)
+    try:
+        while True:
+            time.sleep(5)
+            for i, processo in list(processos.items()):
+                if processo.poll() is not None:
+                    print(f"⚠️ worker {i} saiu com código {processo.returncode}; reiniciando.")
+                    iniciar(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for processo in processos.values():
+            processo.terminate()
+        for processo in processos.values():
+            processo.wait()
+
 if __name__ == "__main__":
     token = os.getenv("TOKEN")
     if not token:
         print("❌ variável TOKEN não encontrada. defina TOKEN no ambiente e rode novamente.")
+    elif SHARD_WORKERS > 1:
+        rodar_workers(SHARD_WORKERS)
     else:
-        bot.run(token)
+        if SHARD_IDS is not None and SHARD_COUNT:
+            meus_shards = set(SHARD_IDS)
+            estado.filtro_guild = lambda guild_id: shard_da_guild(guild_id, SHARD_COUNT) in meus_shards
+        inicio = time.perf_counter()
+        carregados = estado.carregar()
+        print(f"💾 estado carregado: {carregados} registros em {(time.perf_counter() - inicio) * 1000:.1f}ms")
+        try:
+            bot.run(token)
+        finally:
+            estado.flush_sync()